@@ -0,0 +1,47 @@
+"""Added message and user_chat indexes
+
+Revision ID: 8e1f3c2a9b47
+Revises: 5c82424697fb
+Create Date: 2023-06-02 18:41:12.503127
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8e1f3c2a9b47"
+down_revision = "5c82424697fb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_message_chat_id_id",
+            "message",
+            ["chat_id", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_user_chat_chat_id",
+            "user_chat",
+            ["chat_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_chat_chat_id",
+            table_name="user_chat",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_message_chat_id_id",
+            table_name="message",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,51 @@
+"""Added user search indexes
+
+Revision ID: b4a7d2e91c3f
+Revises: 8e1f3c2a9b47
+Create Date: 2023-06-05 12:17:45.219841
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b4a7d2e91c3f"
+down_revision = "8e1f3c2a9b47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CONCURRENTLY can't run inside transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_username_trgm",
+            "user",
+            [sa.text("lower(username) gin_trgm_ops")],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_user_username_prefix",
+            "user",
+            [sa.text("lower(username) text_pattern_ops")],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_username_prefix",
+            table_name="user",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_user_username_trgm",
+            table_name="user",
+            postgresql_concurrently=True,
+        )
@@ -1,43 +1,88 @@
+from typing import Iterable
+
 from fastapi import Depends
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import Chat, UserChat
-from app.dependencies.database import get_db
-from app.schemas.chat_schemas import AddUserSchema, ChatCreateSchema
+from app.crud.user import USER_INFO_COLUMNS
+from app.database.models import Chat, User, UserChat
+from app.dependencies.database import get_async_db
+from app.schemas.chat_schemas import (AddUserSchema, ChatCreateSchema,
+                                      ChatGetSchema)
+from app.schemas.user_schemas import UserGetSchema
 
 
-def create_chat(
-    chat_schema: ChatCreateSchema, db: Session = Depends(get_db)
-) -> Chat:
-    db_chat = Chat(**chat_schema.dict())
-    db.add(db_chat)
-    db.commit()
-    db.refresh(db_chat)
-    return db_chat
+async def create_chat(
+    chat_schema: ChatCreateSchema, db: AsyncSession = Depends(get_async_db)
+) -> Row:
+    query = (
+        insert(Chat).values(**chat_schema.dict()).returning(Chat.id, Chat.name)
+    )
+    return (await db.execute(query)).one()
 
 
-def add_user_to_chat(
-    chat_id: int, add_user_schema: AddUserSchema, db: Session = Depends(get_db)
+async def add_user_to_chat(
+    chat_id: int,
+    add_user_schema: AddUserSchema,
+    db: AsyncSession = Depends(get_async_db),
 ) -> None:
     user_chat_dict = add_user_schema.dict()
     user_chat_dict["chat_id"] = chat_id
     user_chat = UserChat(**user_chat_dict)
     db.add(user_chat)
-    db.commit()
+    await db.flush()
     return None
 
 
-def get_chat_by_id(chat_id: int, db: Session = Depends(get_db)) -> Chat | None:
-    return db.query(Chat).filter(Chat.id == chat_id).first()
+async def get_chat_by_id(
+    chat_id: int, db: AsyncSession = Depends(get_async_db)
+) -> Chat | None:
+    return await db.scalar(select(Chat).where(Chat.id == chat_id))
+
+
+async def get_user_chat_ids(
+    user_ids: Iterable[int], db: AsyncSession = Depends(get_async_db)
+) -> dict[int, set[int]]:
+    chat_ids = {user_id: set() for user_id in user_ids}
+    query = select(UserChat.user_id, UserChat.chat_id).where(
+        UserChat.user_id.in_(chat_ids)
+    )
+    for user_id, chat_id in await db.execute(query):
+        chat_ids[user_id].add(chat_id)
+    return chat_ids
+
+
+async def get_user_chats(
+    user_id: int,
+    page_size: int = 100,
+    after: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> list[ChatGetSchema]:
+    """Chats ordered by id, after is id of the last chat on previous page"""
+    query = (
+        select(Chat.id, Chat.name)
+        .join(UserChat, UserChat.chat_id == Chat.id)
+        .where(UserChat.user_id == user_id)
+    )
+    if after is not None:
+        query = query.where(Chat.id > after)
+    rows = await db.execute(query.order_by(Chat.id).limit(page_size))
+    return [ChatGetSchema.from_orm(row) for row in rows]
 
 
-def user_in_chat(
-    user_id: int, chat_id: int, db: Session = Depends(get_db)
-) -> bool:
-    user_chat = (
-        db.query(UserChat)
-        .filter(and_(UserChat.user_id == user_id, UserChat.chat_id == chat_id))
-        .first()
+async def get_chat_users(
+    chat_id: int,
+    page_size: int = 100,
+    after: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> list[UserGetSchema]:
+    """Users ordered by id, after is id of the last user on previous page"""
+    query = (
+        select(*USER_INFO_COLUMNS)
+        .join(UserChat, UserChat.user_id == User.id)
+        .where(UserChat.chat_id == chat_id)
     )
-    return user_chat is not None
+    if after is not None:
+        query = query.where(User.id > after)
+    rows = await db.execute(query.order_by(User.id).limit(page_size))
+    return [UserGetSchema.from_orm(row) for row in rows]
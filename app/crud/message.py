@@ -1,42 +1,123 @@
-from typing import Iterable, Optional
+from typing import AsyncIterator, Iterable, Optional, Sequence
 
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.crud.exceptions import ConstraintError
 from app.database.models import Message
-from app.dependencies.database import get_db
+from app.dependencies.database import get_async_db
 from app.schemas.message_schemas import MessageCreateSchema
 
+# Columns of MessageGetSchema, also read back by RETURNING after writes
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.chat_id,
+    Message.user_id,
+    Message.content,
+    Message.date_send,
+)
 
-def create_message(
+
+async def create_message(
     user_id: int,
     chat_id: int,
     message_schema: MessageCreateSchema,
-    db: Session = Depends(get_db),
-) -> Message:
-    message_dict = message_schema.dict()
-    message_dict["user_id"] = user_id
-    message_dict["chat_id"] = chat_id
-    db_message = Message(**message_dict)
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    return db_message
-
-
-def get_messages(
+    db: AsyncSession = Depends(get_async_db),
+) -> Row:
+    query = (
+        insert(Message)
+        .values(user_id=user_id, chat_id=chat_id, **message_schema.dict())
+        .returning(*MESSAGE_COLUMNS)
+    )
+    return (await db.execute(query)).one()
+
+
+async def create_messages(
+    user_id: int,
+    chat_id: int,
+    message_schemas: list[MessageCreateSchema],
+    db: AsyncSession = Depends(get_async_db),
+) -> list[Row]:
+    """Inserts whole batch with one statement, rows are ordered by id"""
+    query = (
+        insert(Message)
+        .values(
+            [
+                {"user_id": user_id, "chat_id": chat_id, **schema.dict()}
+                for schema in message_schemas
+            ]
+        )
+        .returning(*MESSAGE_COLUMNS)
+    )
+    rows = (await db.execute(query)).all()
+    return sorted(rows, key=lambda row: row.id)
+
+
+async def get_messages(
     chat_id: int,
     page_size: int = 100,
     start: Optional[int] = None,
-    db: Session = Depends(get_db),
+    after: Optional[int] = None,
+    around: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> Iterable[Message]:
+    """
+    Page of chat messages in ascending order.
+    start - messages older than start, newest ones if not set
+    after - messages newer than after
+    around - messages around id, including message itself
+    """
+    if sum(cursor is not None for cursor in (start, after, around)) > 1:
+        raise ConstraintError("Only one of start, after, around allowed")
+    query = select(Message).where(Message.chat_id == chat_id)
+    if after is not None:
+        newer = query.where(Message.id > after).order_by(Message.id)
+        return (await db.scalars(newer.limit(page_size))).all()
+
+    older = query.order_by(Message.id.desc())
+    if around is not None:
+        older = older.where(Message.id <= around)
+        older_size = page_size // 2 + 1
+        res = (await db.scalars(older.limit(older_size))).all()[::-1]
+        newer = query.where(Message.id > around).order_by(Message.id)
+        newer_size = page_size - len(res)
+        return res + (await db.scalars(newer.limit(newer_size))).all()
+
+    if start:
+        older = older.where(Message.id < start)
+    res = (await db.scalars(older.limit(page_size))).all()
+    return res[::-1]
+
+
+async def get_last_message(
+    chat_id: int, db: AsyncSession = Depends(get_async_db)
+) -> Row | None:
+    """Id and send date of the newest chat message"""
     query = (
-        db.query(Message)
-        .filter(Message.chat_id == chat_id)
+        select(Message.id, Message.date_send)
+        .where(Message.chat_id == chat_id)
         .order_by(Message.id.desc())
+        .limit(1)
     )
-    if start:
-        query = query.filter(Message.id < start)
-    query = query.limit(page_size)
-    res = query.all()
-    return res[::-1]
+    return (await db.execute(query)).first()
+
+
+async def stream_messages(
+    chat_id: int,
+    batch_size: int = 1000,
+    db: AsyncSession = Depends(get_async_db),
+) -> AsyncIterator[Sequence[Row]]:
+    """
+    Whole chat history in ascending order, read from server side cursor
+    in batches of batch_size rows
+    """
+    query = (
+        select(*MESSAGE_COLUMNS)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(query)
+    async for rows in result.partitions():
+        yield rows
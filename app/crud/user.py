@@ -1,87 +1,150 @@
-from typing import Iterable
+from typing import Iterable, Literal
 
 from fastapi import Depends
-from sqlalchemy import func
+from sqlalchemy import Row, and_, func, insert, or_, select, tuple_, update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.crud.exceptions import AlreadyExistsError, CrudError
 from app.database.models import User
-from app.dependencies.database import get_db
-from app.dependencies.settings import get_auth_settings
-from app.schemas.user_schemas import UserCreateSchema, UserUpdateSchema
+from app.dependencies.database import get_async_db
+from app.dependencies.hashing import get_password_hasher
+from app.schemas.user_schemas import (UserCreateSchema, UserGetSchema,
+                                      UserUpdateSchema)
 
+USER_INFO_COLUMNS = (
+    User.id,
+    User.username,
+    User.first_name,
+    User.last_name,
+    User.date_created,
+)
 
-def get_password_hash(password):
-    return get_auth_settings().pwd_context.hash(password)
 
+async def get_password_hash(password):
+    return await get_password_hasher().hash(password)
 
-def get_user_by_name(
-    username: str, db: Session = Depends(get_db)
+
+async def get_user_by_name(
+    username: str, db: AsyncSession = Depends(get_async_db)
 ) -> User | None:
-    if user := db.query(User).filter(User.username == username).first():
+    if user := await db.scalar(select(User).where(User.username == username)):
         return user
     return None
 
 
-def get_user_by_id(user_id: int, db: Session = Depends(get_db)) -> User | None:
-    if user := db.query(User).filter(User.id == user_id).first():
+async def get_user_by_id(
+    user_id: int, db: AsyncSession = Depends(get_async_db)
+) -> User | None:
+    if user := await db.scalar(select(User).where(User.id == user_id)):
         return user
     return None
 
 
-def create_user(
-    user_schema: UserCreateSchema, db: Session = Depends(get_db)
-) -> User:
+async def get_user_info_by_id(
+    user_id: int, db: AsyncSession = Depends(get_async_db)
+) -> UserGetSchema | None:
+    query = select(*USER_INFO_COLUMNS).where(User.id == user_id)
+    if user := (await db.execute(query)).first():
+        return UserGetSchema.from_orm(user)
+    return None
+
+
+async def create_user(
+    user_schema: UserCreateSchema, db: AsyncSession = Depends(get_async_db)
+) -> Row:
     try:
-        passhash = get_password_hash(user_schema.password)
+        passhash = await get_password_hash(user_schema.password)
         user_dict = user_schema.dict(
             exclude_unset=True, exclude_none=True, exclude={"password"}
         )
         user_dict["passhash"] = passhash
-        db_user = User(**user_dict)
-        db.add(db_user)
-        db.commit()
+        query = insert(User).values(**user_dict).returning(*USER_INFO_COLUMNS)
+        return (await db.execute(query)).one()
     except IntegrityError as exc:
         raise AlreadyExistsError("Username already taken") from exc
     except SQLAlchemyError as exc:
         raise CrudError("") from exc
 
-    db.refresh(db_user)
-    return db_user
-
 
-def update_user(
+async def update_user(
+    user_id: int,
     user_schema: UserUpdateSchema,
-    db_user: User,
-    db: Session = Depends(get_db),
-) -> User:
+    db: AsyncSession = Depends(get_async_db),
+) -> Row | None:
+    """Updated user info, None if there is no such user"""
     user_dict = user_schema.dict(
         exclude_unset=True, exclude_none=True, exclude={"password"}
     )
     if user_schema.password:
-        user_dict["passhash"] = get_password_hash(user_schema.password)
-    for key, value in user_dict.items():
-        if hasattr(db_user, key):
-            setattr(db_user, key, value)
+        user_dict["passhash"] = await get_password_hash(user_schema.password)
+    user_dict = {
+        key: value for key, value in user_dict.items() if hasattr(User, key)
+    }
+    if not user_dict:
+        query = select(*USER_INFO_COLUMNS).where(User.id == user_id)
+    else:
+        query = (
+            update(User)
+            .where(User.id == user_id)
+            .values(**user_dict)
+            .returning(*USER_INFO_COLUMNS)
+        )
     try:
-        db.add(db_user)
-        db.commit()
+        return (await db.execute(query)).first()
     except SQLAlchemyError as exc:
         raise CrudError("") from exc
-    db.refresh(db_user)
-    return db_user
 
 
-def search_user(
+async def set_user_passhash(
+    db_user: User, passhash: str, db: AsyncSession = Depends(get_async_db)
+) -> None:
+    db_user.passhash = passhash
+    try:
+        await db.flush()
+    except SQLAlchemyError as exc:
+        raise CrudError("") from exc
+
+
+async def search_user(
     match: str | None = None,
     limit: int = 5,
-    db: Session = Depends(get_db)
+    mode: Literal["contains", "prefix"] = "contains",
+    after: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> Iterable[User]:
-    query = db.query(User)
-    if match:
-        query = query.filter(
-            func.lower(User.username).contains(func.lower(match))
+    """
+    Without match users are ordered by id, prefix matches by username
+    and substring matches by trigram similarity to match.
+    after is id of the last user on previous page
+    """
+    username = func.lower(User.username)
+    query = select(User)
+    if not match:
+        order = (User.id,)
+        if after is not None:
+            query = query.where(User.id > after)
+    elif mode == "prefix":
+        order = (username, User.id)
+        query = query.where(
+            username.startswith(match.lower(), autoescape=True)
         )
-
-    return query.order_by(User.id).limit(limit).all()
+        if after is not None:
+            last = select(username).where(User.id == after).scalar_subquery()
+            query = query.where(
+                tuple_(username, User.id) > tuple_(last, after)
+            )
+    else:
+        similarity = func.similarity(username, match.lower())
+        order = (similarity.desc(), User.id)
+        query = query.where(username.contains(match.lower(), autoescape=True))
+        if after is not None:
+            last = select(similarity).where(User.id == after).scalar_subquery()
+            query = query.where(
+                or_(
+                    similarity < last,
+                    and_(similarity == last, User.id > after),
+                )
+            )
+
+    return (await db.scalars(query.order_by(*order).limit(limit))).all()
@@ -1,13 +1,27 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, String,
+                        Text)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 Base = declarative_base()
 
 
 class User(Base):
     __tablename__ = "user"
+    __table_args__ = (
+        Index(
+            "ix_user_username_trgm",
+            func.lower(text("username")).label("username_lower"),
+            postgresql_using="gin",
+            postgresql_ops={"username_lower": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_user_username_prefix",
+            func.lower(text("username")).label("username_lower"),
+            postgresql_ops={"username_lower": "text_pattern_ops"},
+        ),
+    )
     id = Column(Integer, primary_key=True)
     username = Column(String(63), unique=True, nullable=False)
     passhash = Column(Text, nullable=False)
@@ -27,6 +41,7 @@ class Chat(Base):
 
 class UserChat(Base):
     __tablename__ = "user_chat"
+    __table_args__ = (Index("ix_user_chat_chat_id", "chat_id"),)
     user_id = Column(ForeignKey("user.id"), primary_key=True)
     chat_id = Column(ForeignKey("chat.id"), primary_key=True)
     user = relationship("User", back_populates="chats")
@@ -35,6 +50,7 @@ class UserChat(Base):
 
 class Message(Base):
     __tablename__ = "message"
+    __table_args__ = (Index("ix_message_chat_id_id", "chat_id", "id"),)
     id = Column(Integer, primary_key=True)
     user_id = Column(ForeignKey("user.id"), nullable=False)
     chat_id = Column(ForeignKey("chat.id"), nullable=False)
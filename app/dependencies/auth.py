@@ -1,8 +1,13 @@
 from functools import lru_cache
 
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from fastapi.security import OAuth2PasswordBearer
+from jose import jwk
+from jose.backends.base import Key
 
-from app.dependencies.settings import get_fastapi_settings
+from app.dependencies.cache import TTLCache
+from app.dependencies.settings import get_auth_settings, get_fastapi_settings
 
 
 @lru_cache()
@@ -10,3 +15,52 @@ def get_oauth_scheme():
     return OAuth2PasswordBearer(
         tokenUrl=f"{get_fastapi_settings().base_path}/auth/signin"
     )
+
+
+@lru_cache()
+def get_token_cache() -> TTLCache:
+    """
+    Payloads of already verified tokens by sha256 of raw token
+    """
+    return TTLCache(get_auth_settings().token_cache_size)
+
+
+EC_ALGORITHMS = {
+    "secp256r1": "ES256",
+    "secp384r1": "ES384",
+    "secp521r1": "ES512",
+}
+
+
+def get_key_algorithm(public_key: str, default: str) -> str:
+    """
+    Algorithm for verification key, keeps default if it fits key type
+    """
+    key = load_pem_public_key(public_key.encode("ascii"))
+    if isinstance(key, rsa.RSAPublicKey):
+        return default if default.startswith("RS") else "RS256"
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        return EC_ALGORITHMS[key.curve.name]
+    raise ValueError(f"Unsupported key type {type(key).__name__}")
+
+
+@lru_cache()
+def get_signing_key() -> Key:
+    settings = get_auth_settings()
+    return jwk.construct(settings.private_key, settings.algorithm)
+
+
+@lru_cache()
+def get_verification_keys() -> dict[str, tuple[Key, str]]:
+    """
+    Parsed public keys with their algorithms by key id.
+    Extra keys keep tokens signed before key rotation valid
+    """
+    settings = get_auth_settings()
+    public_keys = {**settings.verification_keys}
+    public_keys[settings.key_id] = settings.public_key
+    keys = {}
+    for key_id, public_key in public_keys.items():
+        algorithm = get_key_algorithm(public_key, settings.algorithm)
+        keys[key_id] = (jwk.construct(public_key, algorithm), algorithm)
+    return keys
@@ -1,40 +1,201 @@
 import asyncio
-import json
+import logging
+import time
+from abc import ABC, abstractmethod
 from calendar import timegm
 from datetime import datetime
-from functools import lru_cache
+from functools import lru_cache, partial
+from typing import Awaitable, Callable, Iterable
 
+import orjson
 from fastapi import WebSocket
-from redis import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.client import PubSub
+from redis.asyncio.connection import HiredisParser
+from redis.commands.core import AsyncScript
+from redis.exceptions import NoScriptError, RedisError
 
-from app.dependencies.settings import get_redis_settings
+from app.dependencies.cache import TTLCache
+from app.dependencies.metrics import BROADCAST_FANOUT, REDIS_DURATION
+from app.dependencies.settings import (get_auth_settings, get_chat_settings,
+                                       get_fastapi_settings,
+                                       get_redis_settings)
 from app.schemas.auth_schemas import TokenPayload
 from app.schemas.message_schemas import MessageGetSchema
+from app.schemas.user_schemas import UserGetSchema
 
 
 @lru_cache()
 def get_redis_client() -> Redis:
     settings = get_redis_settings()
-    return Redis(
-        host=settings.host, password=settings.password, decode_responses=True
+    pool = BlockingConnectionPool(
+        host=settings.host,
+        port=settings.port,
+        db=settings.db,
+        password=settings.password,
+        max_connections=settings.max_connections,
+        timeout=settings.pool_timeout,
+        socket_timeout=settings.socket_timeout,
+        socket_connect_timeout=settings.socket_connect_timeout,
+        health_check_interval=settings.health_check_interval,
+        parser_class=HiredisParser,
+        decode_responses=True,
     )
+    return Redis(connection_pool=pool)
+
+
+class RevocationCache:
+    """
+    Process local copy of revoked tokens.
+    Kept up to date by revocation channel, fully reloaded from redis on
+    every (re)connect. Answers only while in sync with redis
+    """
+
+    channel = "token_revocations"
+    key_pattern = "Token *"
+    purge_interval = 60
+    client: Redis
+    revoked: dict[str, int]
+    synced: bool
+    listener: asyncio.Task | None
+
+    def __init__(self, client: Redis):
+        self.client = client
+        self.revoked = {}
+        self.synced = False
+        self.listener = None
+        self.next_purge = 0.0
+
+    def start(self):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        self.synced = False
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+
+    def add(self, jti: str, exp: int):
+        self.revoked[jti] = exp
+
+    def has(self, jti: str) -> bool:
+        exp = self.revoked.get(jti)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            self.revoked.pop(jti, None)
+            return False
+        return True
+
+    def _purge(self):
+        now = time.time()
+        self.revoked = {
+            jti: exp for jti, exp in self.revoked.items() if exp > now
+        }
+        self.next_purge = time.monotonic() + self.purge_interval
+
+    async def _resync(self):
+        keys = [
+            key
+            async for key in self.client.scan_iter(
+                match=self.key_pattern, count=1000
+            )
+        ]
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.ttl(key)
+            ttls = await pipe.execute()
+        now = int(time.time())
+        revoked = {
+            key.split(" ", 1)[1]: now + ttl
+            for key, ttl in zip(keys, ttls)
+            if ttl > 0
+        }
+        revoked.update(self.revoked)
+        self.revoked = revoked
+        self._purge()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                await self._resync()
+                self.synced = True
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        jti, exp = message["data"].split(" ")
+                        self.add(jti, int(exp))
+                    if time.monotonic() >= self.next_purge:
+                        self._purge()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.synced = False
+                logging.getLogger(__name__).warning(
+                    "Revocation cache out of sync: %r", exc
+                )
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
 
 
 class RedisTokenStorage:
     client: Redis
+    cache: RevocationCache | None
 
     def __init__(self):
         self.client = get_redis_client()
+        self.cache = None
+        if get_redis_settings().revocation_cache:
+            self.cache = RevocationCache(self.client)
+
+    @staticmethod
+    def _key(token: TokenPayload) -> str:
+        return f"Token {token.jti}"
+
+    def _cache_ready(self) -> bool:
+        if self.cache is None:
+            return False
+        self.cache.start()
+        return self.cache.synced
 
-    def add_token(self, token: TokenPayload) -> None:
+    async def add_token(self, token: TokenPayload) -> None:
         time_left = token.exp - timegm(datetime.utcnow().utctimetuple())
         if time_left > 0:
-            self.client.set(f"Token {token.jti}", " ", ex=time_left)
+            with REDIS_DURATION.labels("add_token").time():
+                await self.client.set(self._key(token), " ", ex=time_left)
+            if self.cache is not None:
+                self.cache.add(token.jti, token.exp)
+            with REDIS_DURATION.labels("publish").time():
+                await self.client.publish(
+                    RevocationCache.channel, f"{token.jti} {token.exp}"
+                )
 
-    def has_token(self, token: TokenPayload) -> bool:
-        if _ := self.client.get(f"Token {token.jti}"):
-            return True
-        return False
+    async def has_token(self, token: TokenPayload) -> bool:
+        if self._cache_ready():
+            return self.cache.has(token.jti)
+        with REDIS_DURATION.labels("has_token").time():
+            return await self.client.exists(self._key(token)) > 0
+
+    async def has_tokens(self, tokens: Iterable[TokenPayload]) -> list[bool]:
+        """
+        Checks many tokens in one round trip, result keeps order of tokens
+        """
+        if self._cache_ready():
+            return [self.cache.has(token.jti) for token in tokens]
+        async with self.client.pipeline(transaction=False) as pipe:
+            for token in tokens:
+                pipe.exists(self._key(token))
+            with REDIS_DURATION.labels("has_tokens").time():
+                results = await pipe.execute()
+            return [exists > 0 for exists in results]
+
+    async def close(self):
+        if self.cache is not None:
+            await self.cache.close()
 
 
 @lru_cache()
@@ -42,48 +203,507 @@ def get_token_storage() -> RedisTokenStorage:
     return RedisTokenStorage()
 
 
-class BaseWebsocketManager:
-    connections: list[WebSocket]
+class UserCache:
+    """
+    Short lived cache of users resolved from tokens.
+    Process local, optionally backed by redis to share entries between
+    processes. Writers must refresh or invalidate entries
+    """
+
+    prefix = "User "
+    ttl: int
+    local: TTLCache
+    client: Redis | None
 
     def __init__(self):
-        self.connections = []
+        settings = get_auth_settings()
+        self.ttl = settings.user_cache_ttl
+        self.local = TTLCache(settings.user_cache_size)
+        self.client = None
+        if settings.user_cache_redis:
+            self.client = get_redis_client()
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.connections.append(websocket)
+    async def get(self, user_id: int) -> UserGetSchema | None:
+        if user := self.local.get(user_id):
+            return user
+        if self.client is None:
+            return None
+        if data := await self.client.get(f"{self.prefix}{user_id}"):
+            user = UserGetSchema.parse_raw(data)
+            self.local.set(user_id, user, time.time() + self.ttl)
+            return user
+        return None
 
-    async def broadcast(self, data: str):
-        await asyncio.gather(
-            *[connection.send_text(data) for connection in self.connections]
+    async def set(self, user: UserGetSchema):
+        self.local.set(user.id, user, time.time() + self.ttl)
+        if self.client is not None:
+            await self.client.set(
+                f"{self.prefix}{user.id}", user.json(), ex=self.ttl
+            )
+
+
+@lru_cache()
+def get_user_cache() -> UserCache:
+    return UserCache()
+
+
+class RedisMembershipStorage:
+    """
+    Index of chat ids per user kept in redis sets.
+    Sets are loaded from database on miss, every membership change bumps
+    user's version so loads racing with changes are discarded
+    """
+
+    # Set always contains 0 so users without chats are cached too
+    placeholder = 0
+    # Redis runs Lua 5.1, fakeredis (smoke runs) Lua 5.4 without unpack
+    load_script = """
+        local unpack = table.unpack or unpack
+        if (redis.call('get', KEYS[2]) or '0') ~= ARGV[1] then
+            return 0
+        end
+        redis.call('del', KEYS[1])
+        redis.call('sadd', KEYS[1], unpack(ARGV, 3))
+        redis.call('expire', KEYS[1], ARGV[2])
+        return 1
+    """
+    add_script = """
+        redis.call('incr', KEYS[2])
+        redis.call('expire', KEYS[2], ARGV[2])
+        if redis.call('exists', KEYS[1]) == 1 then
+            redis.call('sadd', KEYS[1], ARGV[1])
+        end
+    """
+    client: Redis
+    ttl: int
+
+    def __init__(self):
+        self.client = get_redis_client()
+        self.ttl = get_redis_settings().membership_ttl
+        self._load = self.client.register_script(self.load_script)
+        self._add = self.client.register_script(self.add_script)
+
+    @staticmethod
+    def _keys(user_id: int) -> list[str]:
+        return [f"UserChats {user_id}", f"UserChatsVersion {user_id}"]
+
+    async def has_members(
+        self, pairs: Iterable[tuple[int, int]]
+    ) -> list[tuple[bool | None, str]]:
+        """
+        Checks (user_id, chat_id) pairs in one round trip.
+        For each pair returns membership (None if user isn't cached)
+        and user's version to pass into set_chats
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id, chat_id in pairs:
+                key, version_key = self._keys(user_id)
+                pipe.exists(key)
+                pipe.sismember(key, chat_id)
+                pipe.get(version_key)
+            result = await pipe.execute()
+        return [
+            (bool(is_member) if exists else None, version or "0")
+            for exists, is_member, version in zip(
+                result[::3], result[1::3], result[2::3]
+            )
+        ]
+
+    async def load_scripts(self) -> None:
+        """Registers scripts up front, so first calls skip NOSCRIPT retry"""
+        try:
+            for script in (self._load, self._add):
+                await self.client.script_load(script.script)
+        except RedisError as exc:
+            logging.getLogger(__name__).warning(
+                "Couldn't preload membership scripts: %r", exc
+            )
+
+    async def _run(self, script: AsyncScript, keys: list, args: list):
+        try:
+            return await script(keys=keys, args=args)
+        except NoScriptError:
+            # Script cache was flushed or EVALSHA raced with SCRIPT LOAD
+            return await self.client.eval(
+                script.script, len(keys), *keys, *args
+            )
+
+    async def set_chats(
+        self, user_id: int, chat_ids: Iterable[int], version: str
+    ) -> None:
+        await self._run(
+            self._load,
+            self._keys(user_id),
+            [version, self.ttl, self.placeholder, *chat_ids],
         )
 
-    def remove(self, websocket: WebSocket):
-        if websocket in self.connections:
-            self.connections.remove(websocket)
+    async def add_member(self, user_id: int, chat_id: int) -> None:
+        await self._run(self._add, self._keys(user_id), [chat_id, self.ttl])
 
 
-class ChatSocketsManager:
-    managers: dict[int, BaseWebsocketManager]
+@lru_cache()
+def get_membership_storage() -> RedisMembershipStorage:
+    return RedisMembershipStorage()
+
+
+def dump_frame(data: dict) -> str:
+    """
+    Websocket text frame, datetimes are written in ISO 8601
+    the same way as in http responses
+    """
+    return orjson.dumps(data).decode()
+
+
+class WebsocketConnection:
+    """
+    Websocket with bounded outbound queue drained by its own writer task,
+    so slow client never holds up broadcasts to other clients
+    """
+
+    websocket: WebSocket
+    user_id: int
+    chat_ids: set[int]
+    follow: bool
+    queue: asyncio.Queue
+    slow_consumer: str
+    on_close: Callable[["WebsocketConnection"], None]
+    writer: asyncio.Task | None
+    overflowed: bool
+    dropped: int
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        queue_size: int,
+        slow_consumer: str,
+        on_close: Callable[["WebsocketConnection"], None],
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.chat_ids = set()
+        self.follow = False
+        self.queue = asyncio.Queue(queue_size)
+        self.slow_consumer = slow_consumer
+        self.on_close = on_close
+        self.writer = None
+        self.overflowed = False
+        self.dropped = 0
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write())
+
+    def stop(self):
+        if self.writer is not None:
+            self.writer.cancel()
+
+    def send(self, frame: str):
+        if self.writer is None or self.writer.done() or self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            if self.slow_consumer == "drop":
+                self.dropped += 1
+                return
+            self.overflowed = True
+            self.stop()
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            if self.overflowed:
+                await self._close(4008, "Too slow")
+        except Exception as exc:
+            logging.getLogger(__name__).debug("Websocket send: %r", exc)
+        finally:
+            self.on_close(self)
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code, reason)
+        except Exception:
+            pass
+
+
+BroadcastCallback = Callable[[str], Awaitable[None]]
+
+
+class BroadcastBackend(ABC):
+    """
+    Delivers published payloads to every process subscribed to a topic
+    """
+
+    @abstractmethod
+    async def subscribe(self, topic: str, callback: BroadcastCallback):
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, topic: str):
+        ...
+
+    @abstractmethod
+    async def publish(self, topic: str, data: str):
+        ...
+
+    async def close(self):
+        pass
+
+
+class MemoryBroadcastBackend(BroadcastBackend):
+    """
+    Broadcast backend for single process deployments
+    """
+
+    callbacks: dict[str, BroadcastCallback]
+
+    def __init__(self):
+        self.callbacks = {}
+
+    async def subscribe(self, topic: str, callback: BroadcastCallback):
+        self.callbacks[topic] = callback
+
+    async def unsubscribe(self, topic: str):
+        self.callbacks.pop(topic, None)
+
+    async def publish(self, topic: str, data: str):
+        if callback := self.callbacks.get(topic):
+            await callback(data)
+
+
+class RedisBroadcastBackend(BroadcastBackend):
+    """
+    Broadcast backend sharing payloads between processes via redis pub/sub.
+    Process listens only to topics it has subscribed to
+    """
+
+    prefix = "broadcast:"
+    client: Redis
+    pubsub: PubSub | None
+    listener: asyncio.Task | None
 
     def __init__(self):
-        self.managers = {}
+        self.client = get_redis_client()
+        self.pubsub = None
+        self.listener = None
+
+    async def subscribe(self, topic: str, callback: BroadcastCallback):
+        if self.pubsub is None:
+            self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+
+        async def handler(message: dict):
+            await callback(message["data"])
+
+        await self.pubsub.subscribe(**{self.prefix + topic: handler})
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(
+                self.pubsub.run(exception_handler=self._on_error)
+            )
+
+    async def unsubscribe(self, topic: str):
+        if self.pubsub is not None:
+            await self.pubsub.unsubscribe(self.prefix + topic)
+
+    async def publish(self, topic: str, data: str):
+        await self.client.publish(self.prefix + topic, data)
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+        if self.pubsub is not None:
+            await self.pubsub.close()
+            self.pubsub = None
+
+    @staticmethod
+    async def _on_error(exc: BaseException, _: PubSub):
+        logging.getLogger(__name__).warning("Broadcast listener: %r", exc)
+        await asyncio.sleep(1)
+
+
+@lru_cache()
+def get_broadcast_backend() -> BroadcastBackend:
+    if get_fastapi_settings().broadcast_backend == "redis":
+        return RedisBroadcastBackend()
+    return MemoryBroadcastBackend()
+
 
-    async def add_user(self, websocket: WebSocket, chat_id: int):
-        if chat_id not in self.managers:
-            self.managers[chat_id] = BaseWebsocketManager()
-        await self.managers[chat_id].connect(websocket)
+class ChatSocketsManager:
+    """
+    Routes chat broadcasts to local websocket connections.
+    Connection may listen to any number of chats, chat topic stays
+    subscribed on broadcast backend while some connection listens to it.
+    Connections following membership join chats user is added to
+    """
+
+    connections: dict[WebSocket, WebsocketConnection]
+    chats: dict[int, set[WebsocketConnection]]
+    users: dict[int, set[WebsocketConnection]]
+    pending: dict[str, asyncio.Future]
+    backend: BroadcastBackend
+
+    def __init__(self, backend: BroadcastBackend | None = None):
+        settings = get_chat_settings()
+        self.queue_size = settings.websocket_queue_size
+        self.slow_consumer = settings.websocket_slow_consumer
+        self.connections = {}
+        self.chats = {}
+        self.users = {}
+        self.pending = {}
+        self.backend = backend or MemoryBroadcastBackend()
+
+    @staticmethod
+    def _topic(chat_id: int) -> str:
+        return f"chat:{chat_id}"
+
+    @staticmethod
+    def _user_topic(user_id: int) -> str:
+        return f"user:{user_id}"
+
+    async def _subscribe_topic(
+        self, topic: str, callback: BroadcastCallback
+    ):
+        """
+        Subscribes topic on backend once, connections arriving while
+        subscription is in flight wait for the same call and share its
+        outcome. Callers register in index only after it succeeded,
+        so failed subscription leaves nothing to roll back
+        """
+        pending = self.pending.get(topic)
+        if pending is None:
+            pending = asyncio.ensure_future(
+                self.backend.subscribe(topic, callback)
+            )
+            self.pending[topic] = pending
+            pending.add_done_callback(partial(self._forget_pending, topic))
+        await asyncio.shield(pending)
+
+    def _forget_pending(self, topic: str, pending: asyncio.Future):
+        if self.pending.get(topic) is pending:
+            del self.pending[topic]
+        if not pending.cancelled():
+            # Retrieved here so failure is not reported as unhandled
+            # when every waiter was cancelled
+            pending.exception()
 
-    def remove_user(self, websocket: WebSocket, chat_id: int):
-        if chat_id not in self.managers:
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        chat_ids: Iterable[int] = (),
+        follow: bool = False,
+    ) -> WebsocketConnection:
+        await websocket.accept()
+        connection = WebsocketConnection(
+            websocket,
+            user_id,
+            self.queue_size,
+            self.slow_consumer,
+            self._detach,
+        )
+        connection.follow = follow
+        self.connections[websocket] = connection
+        if user_id not in self.users:
+            await self._subscribe_topic(
+                self._user_topic(user_id),
+                partial(self.deliver_user, user_id),
+            )
+        self.users.setdefault(user_id, set()).add(connection)
+        connection.start()
+        for chat_id in chat_ids:
+            await self.subscribe(connection, chat_id)
+        return connection
+
+    async def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
             return
-        self.managers[chat_id].remove(websocket)
-        if len(self.managers[chat_id].connections) == 0:
-            del self.managers[chat_id]
+        connection.stop()
+        for chat_id in list(connection.chat_ids):
+            await self.unsubscribe(connection, chat_id)
+        # Missing when subscribing to user topic failed in connect
+        user_connections = self.users.get(connection.user_id, set())
+        user_connections.discard(connection)
+        if not user_connections and connection.user_id in self.users:
+            del self.users[connection.user_id]
+            await self.backend.unsubscribe(
+                self._user_topic(connection.user_id)
+            )
 
-    async def send_message(self, chat_id: int, message: MessageGetSchema):
-        if chat_id not in self.managers:
+    async def subscribe(self, connection: WebsocketConnection, chat_id: int):
+        if chat_id in connection.chat_ids:
+            return
+        if chat_id not in self.chats:
+            await self._subscribe_topic(
+                self._topic(chat_id), partial(self.deliver, chat_id)
+            )
+        self.chats.setdefault(chat_id, set()).add(connection)
+        connection.chat_ids.add(chat_id)
+
+    async def unsubscribe(
+        self, connection: WebsocketConnection, chat_id: int
+    ):
+        connection.chat_ids.discard(chat_id)
+        if chat_id not in self.chats:
             return
-        msg_dict = message.dict()
-        msg_dict["date_send"] = str(msg_dict["date_send"])
-        msg_str = json.dumps(msg_dict)
-        await self.managers[chat_id].broadcast(msg_str)
+        self.chats[chat_id].discard(connection)
+        if not self.chats[chat_id]:
+            del self.chats[chat_id]
+            await self.backend.unsubscribe(self._topic(chat_id))
+
+    def _detach(self, connection: WebsocketConnection):
+        """Stops routing frames to connection whose writer has stopped"""
+        for chat_id in connection.chat_ids:
+            if chat_id in self.chats:
+                self.chats[chat_id].discard(connection)
+
+    async def deliver(self, chat_id: int, data: str):
+        started = time.perf_counter()
+        # Batches are published as newline separated frames
+        frames = data.split("\n")
+        for connection in list(self.chats.get(chat_id, ())):
+            for frame in frames:
+                connection.send(frame)
+        BROADCAST_FANOUT.observe(time.perf_counter() - started)
+
+    async def deliver_user(self, user_id: int, data: str):
+        event = orjson.loads(data)
+        if event["type"] != "chat_added":
+            return
+        chat_id = event["chat_id"]
+        for connection in list(self.users.get(user_id, ())):
+            if connection.follow and chat_id not in connection.chat_ids:
+                await self.subscribe(connection, chat_id)
+                connection.send(
+                    dump_frame({"type": "subscribed", "chat_id": chat_id})
+                )
+
+    async def add_member(self, user_id: int, chat_id: int):
+        """Subscribes user's following connections in every process"""
+        await self.backend.publish(
+            self._user_topic(user_id),
+            dump_frame({"type": "chat_added", "chat_id": chat_id}),
+        )
+
+    async def send_message(self, chat_id: int, message: MessageGetSchema):
+        await self.send_messages(chat_id, [message])
+
+    async def send_messages(
+        self, chat_id: int, messages: list[MessageGetSchema]
+    ):
+        # Encoded once, every recipient gets the same string
+        frames = [dump_frame(message.dict()) for message in messages]
+        await self.backend.publish(self._topic(chat_id), "\n".join(frames))
+
+    def send_to(self, websocket: WebSocket, data: dict):
+        """Queues frame for single socket after already queued frames"""
+        if connection := self.connections.get(websocket):
+            connection.send(dump_frame(data))
+
+
+@lru_cache()
+def get_chats_manager() -> ChatSocketsManager:
+    return ChatSocketsManager(get_broadcast_backend())
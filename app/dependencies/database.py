@@ -1,29 +1,229 @@
+import asyncio
+import itertools
+import logging
+import time
 from functools import lru_cache
 
-from fastapi import Depends
-from sqlalchemy.engine import Engine, create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Cookie, Depends
+from sqlalchemy.engine import Engine, create_engine, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.dependencies.query_stats import instrument_engine
 from app.dependencies.settings import get_database_settings
 
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+PRIMARY_READS_COOKIE = "db_primary_reads"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
 
 @lru_cache()
 def get_sql_alchemy_engine() -> Engine:
     settings = get_database_settings()
-    return create_engine(
+    engine = create_engine(
         settings.connection_string,
         pool_pre_ping=True,
         connect_args={"application_name": settings.application_name},
     )
+    instrument_engine(engine)
+    return engine
+
+
+def get_async_connection_string(connection_string: str) -> str:
+    url = make_url(connection_string)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        return connection_string
+    url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url.render_as_string(hide_password=False)
+
+
+def create_async_sql_alchemy_engine(
+    connection_string: str, connect_timeout: float | None = None, **kwargs
+) -> AsyncEngine:
+    settings = get_database_settings()
+    connect_args = {
+        "server_settings": {"application_name": settings.application_name}
+    }
+    if connect_timeout is not None:
+        connect_args["timeout"] = connect_timeout
+    engine = create_async_engine(
+        get_async_connection_string(connection_string),
+        pool_pre_ping=True,
+        connect_args=connect_args,
+        **kwargs,
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+@lru_cache()
+def get_async_sql_alchemy_engine() -> AsyncEngine:
+    return create_async_sql_alchemy_engine(
+        get_database_settings().connection_string
+    )
+
+
+@lru_cache()
+def get_async_replica_engines() -> list[AsyncEngine]:
+    settings = get_database_settings()
+    return [
+        create_async_sql_alchemy_engine(
+            connection_string,
+            connect_timeout=settings.replica_connect_timeout,
+            pool_timeout=settings.replica_pool_timeout,
+        )
+        for connection_string in settings.replica_connection_strings
+    ]
+
+
+@lru_cache()
+def get_async_session_maker(engine: AsyncEngine) -> async_sessionmaker:
+    return async_sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+
+
+class ReplicaRouter:
+    """
+    Round robin over replica engines. Replica that fails to give a
+    connection within timeout seconds is skipped for retry_interval
+    seconds, pool_pre_ping makes the checkout itself the health check
+    """
 
+    engines: list[AsyncEngine]
+    retry_interval: float
+    timeout: float | None
+    failed_until: dict[AsyncEngine, float]
 
-def get_session_local(engine: Engine = Depends(get_sql_alchemy_engine)):
-    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    def __init__(
+        self,
+        engines: list[AsyncEngine],
+        retry_interval: float,
+        timeout: float | None = None,
+    ):
+        self.engines = engines
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.failed_until = {}
+        self.counter = itertools.count()
 
+    def candidates(self) -> list[AsyncEngine]:
+        now = time.monotonic()
+        healthy = [
+            engine
+            for engine in self.engines
+            if self.failed_until.get(engine, 0) <= now
+        ]
+        if not healthy:
+            return []
+        start = next(self.counter) % len(healthy)
+        return healthy[start:] + healthy[:start]
 
-def get_db(session_maker=Depends(get_session_local)) -> Session:
-    db: Session = session_maker()
+    def mark_failed(self, engine: AsyncEngine, exc: Exception):
+        self.failed_until[engine] = time.monotonic() + self.retry_interval
+        logging.getLogger(__name__).warning(
+            "Replica %s unavailable for %ss: %s",
+            engine.url.render_as_string(hide_password=True),
+            self.retry_interval,
+            exc,
+        )
+
+    async def connect(self) -> AsyncSession | None:
+        """Session on the first healthy replica, None if there is none"""
+        for engine in self.candidates():
+            db: AsyncSession = get_async_session_maker(engine)()
+            try:
+                # Also bounds the pre-ping, which a dead peer can hang
+                # past the connect timeout
+                await asyncio.wait_for(db.connection(), self.timeout)
+            except (DBAPIError, OSError, asyncio.TimeoutError) as exc:
+                await db.close()
+                self.mark_failed(engine, exc)
+                continue
+            return db
+        return None
+
+
+@lru_cache()
+def get_replica_router() -> ReplicaRouter:
+    settings = get_database_settings()
+    return ReplicaRouter(
+        get_async_replica_engines(),
+        settings.replica_retry_interval,
+        settings.replica_connect_timeout + settings.replica_pool_timeout,
+    )
+
+
+def get_async_session_local(
+    engine: AsyncEngine = Depends(get_async_sql_alchemy_engine),
+):
+    return get_async_session_maker(engine)
+
+
+async def get_async_db(
+    session_maker=Depends(get_async_session_local),
+) -> AsyncSession:
+    """
+    Request scoped unit of work. Crud functions only flush, service
+    commits once after all writes of request, closing rolls back the rest
+    """
+    db: AsyncSession = session_maker()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_async_read_db(
+    primary_reads: str | None = Cookie(None, alias=PRIMARY_READS_COOKIE),
+    primary_db: AsyncSession = Depends(get_async_db),
+    router: ReplicaRouter = Depends(get_replica_router),
+) -> AsyncSession:
+    """
+    Session for read only queries. Goes to a replica unless client wrote
+    recently (see ReadYourWritesMiddleware) or all replicas are down,
+    then shares the request session of get_async_db
+    """
+    if primary_reads is not None or (db := await router.connect()) is None:
+        yield primary_db
+        return
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins reads of a client to the primary for read_your_writes_window
+    seconds after a successful write request, so replication lag
+    doesn't hide just created rows
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.window = get_database_settings().read_your_writes_window
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            if (
+                message["type"] == "http.response.start"
+                and message["status"] < 400
+            ):
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Set-Cookie",
+                    f"{PRIMARY_READS_COOKIE}=1; Max-Age={self.window}; "
+                    "Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
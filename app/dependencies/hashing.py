@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable
+
+from fastapi.concurrency import run_in_threadpool
+from passlib.context import CryptContext
+
+from app.dependencies.settings import get_auth_settings
+from app.services.exceptions import OverloadedError
+
+
+@lru_cache()
+def _load_context(policy: str) -> CryptContext:
+    return CryptContext.from_string(policy)
+
+
+def _hash(policy: str, password: str) -> str:
+    return _load_context(policy).hash(password)
+
+
+def _verify_and_update(
+    policy: str, password: str, passhash: str
+) -> tuple[bool, str | None]:
+    return _load_context(policy).verify_and_update(password, passhash)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt outside of event loop and request threads.
+    With workers = 0 hashes in anyio threadpool instead of process pool.
+    Calls over workers + queue_size in flight are rejected immediately
+    """
+
+    policy: str
+    executor: ProcessPoolExecutor | None
+    limit: int
+    pending: int
+
+    def __init__(self, context: CryptContext, workers: int, queue_size: int):
+        self.policy = context.to_string()
+        self.executor = None
+        if workers > 0:
+            self.executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.limit = workers + queue_size
+        self.pending = 0
+
+    async def _run(self, func: Callable, *args):
+        if self.pending >= self.limit:
+            raise OverloadedError("Server is busy, try again later")
+        self.pending += 1
+        try:
+            if self.executor is None:
+                return await run_in_threadpool(func, self.policy, *args)
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, func, self.policy, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(
+        self, password: str, passhash: str
+    ) -> tuple[bool, str | None]:
+        """
+        Returns whether password matches and new hash
+        if passhash doesn't match current policy
+        """
+        return await self._run(_verify_and_update, password, passhash)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    settings = get_auth_settings()
+    return PasswordHasher(
+        settings.pwd_context, settings.hash_workers, settings.hash_queue_size
+    )
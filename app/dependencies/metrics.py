@@ -0,0 +1,76 @@
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+)
+RESPONSES = Counter(
+    "http_responses",
+    "HTTP responses by route and status",
+    ["method", "route", "status"],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Database pool connections by state",
+    ["engine", "state"],
+)
+REDIS_DURATION = Histogram(
+    "redis_command_duration_seconds",
+    "Redis round trip latency of token storage",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1),
+)
+THREADPOOL_THREADS = Gauge(
+    "threadpool_threads", "anyio threadpool tokens by state", ["state"]
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections", "Open websocket connections"
+)
+WEBSOCKET_CHAT_CONNECTIONS = Gauge(
+    "websocket_chat_connections",
+    "Local websocket connections listening to chat",
+    ["chat_id"],
+)
+BROADCAST_FANOUT = Histogram(
+    "broadcast_fanout_seconds",
+    "Time to queue broadcast payload to every local connection of chat",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+class MetricsMiddleware:
+    """
+    Records latency and status of http requests labeled with route
+    template, so path parameters don't blow up label cardinality
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_DURATION.labels(scope["method"], path).observe(
+                time.perf_counter() - started
+            )
+            RESPONSES.labels(scope["method"], path, status).inc()
@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.dependencies.settings import (get_database_settings,
+                                       get_fastapi_settings)
+
+
+class QueryStats:
+    """
+    Queries and commits executed during one request
+    or assert_max_queries block
+    """
+
+    count: int
+    commits: int
+    duration: float
+    statements: Counter[str]
+
+    def __init__(self):
+        self.count = 0
+        self.commits = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Statement shapes executed at least threshold times"""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+_request_stats: ContextVar[QueryStats | None] = ContextVar(
+    "request_query_stats", default=None
+)
+# Collectors of assert_max_queries, see every query of every thread
+_global_stats: list[QueryStats] = []
+
+
+def _before_cursor_execute(conn, cursor, statement, params, context, many):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, params, context, many):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    if stats := _request_stats.get():
+        stats.record(statement, duration)
+    for stats in _global_stats:
+        stats.record(statement, duration)
+
+
+def _commit(conn):
+    if stats := _request_stats.get():
+        stats.commits += 1
+    for stats in _global_stats:
+        stats.commits += 1
+
+
+def instrument_engine(engine: Engine):
+    """Counts queries of engine, pass sync_engine of async engines"""
+    if not event.contains(
+        engine, "before_cursor_execute", _before_cursor_execute
+    ):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "commit", _commit)
+
+
+@contextmanager
+def assert_max_queries(
+    max_count: int, max_commits: int | None = None
+) -> Iterator[QueryStats]:
+    """
+    Fails if code inside block, including requests made through
+    TestClient, executes more than max_count queries
+    or more than max_commits commits
+    """
+    stats = QueryStats()
+    _global_stats.append(stats)
+    try:
+        yield stats
+    finally:
+        _global_stats.remove(stats)
+    statements = "\n".join(
+        f"{count}x {statement}"
+        for statement, count in stats.statements.items()
+    )
+    assert stats.count <= max_count, (
+        f"Expected at most {max_count} queries, got {stats.count}:\n"
+        + statements
+    )
+    assert max_commits is None or stats.commits <= max_commits, (
+        f"Expected at most {max_commits} commits, got {stats.commits}"
+    )
+
+
+class QueryStatsMiddleware:
+    """
+    Collects queries of every http request. Warns when same statement
+    repeats n_plus_one_threshold times, in debug mode also reports
+    query count, commit count and time in Server-Timing header
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.debug = get_fastapi_settings().debug
+        self.threshold = get_database_settings().n_plus_one_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message: Message):
+            if self.debug and message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.duration * 1000:.2f};'
+                    f'desc="{stats.count} queries, {stats.commits} commits"',
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            if self.threshold > 0:
+                self._check_repeated(scope, stats)
+
+    def _check_repeated(self, scope: Scope, stats: QueryStats):
+        for statement, count in stats.repeated(self.threshold):
+            route = scope.get("route")
+            logging.getLogger(__name__).warning(
+                "Possible N+1 in %s %s: %d executions of %s",
+                scope["method"],
+                route.path if route is not None else scope["path"],
+                count,
+                " ".join(statement.split())[:300],
+            )
@@ -1,7 +1,7 @@
 from functools import lru_cache
 
-from app.settings import (AuthSettings, DatabaseSettings, FastApiSettings,
-                          RedisSettings)
+from app.settings import (AuthSettings, ChatSettings, DatabaseSettings,
+                          FastApiSettings, RedisSettings)
 
 
 @lru_cache()
@@ -19,6 +19,11 @@ def get_fastapi_settings():
     return FastApiSettings()
 
 
+@lru_cache()
+def get_chat_settings():
+    return ChatSettings()
+
+
 @lru_cache()
 def get_redis_settings():
     return RedisSettings()
@@ -1,17 +1,28 @@
-import json
-
 from fastapi import FastAPI, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.crud.exceptions import AlreadyExistsError, ConstraintError, CrudError
-from app.dependencies.settings import get_fastapi_settings
+from app.dependencies.auth import get_signing_key, get_verification_keys
+from app.dependencies.clients import (get_membership_storage, get_redis_client,
+                                      get_token_storage)
+from app.dependencies.database import ReadYourWritesMiddleware
+from app.dependencies.hashing import get_password_hasher
+from app.dependencies.metrics import MetricsMiddleware
+from app.dependencies.query_stats import QueryStatsMiddleware
+from app.dependencies.settings import (get_database_settings,
+                                       get_fastapi_settings)
 from app.exceptions import GeneralException
 from app.routers.auth_router import router as auth_router
 from app.routers.chat_router import router as chat_router
+from app.routers.metrics_router import router as metrics_router
 from app.routers.user_router import router as user_router
 from app.routers.websocket_router import router as websocket_router
-from app.services.exceptions import (NotFoundError, ServiceError,
-                                     UnauthorizedError, WrongCredentialsError)
+from app.services.exceptions import (BadRequestError, NotFoundError,
+                                     NotModifiedError, OverloadedError,
+                                     ServiceError, UnauthorizedError,
+                                     WrongCredentialsError)
+from app.services.message_service import CHATS_MANAGER
 
 settings = get_fastapi_settings()
 
@@ -21,6 +32,7 @@ app = FastAPI(
     docs_url=f"{settings.base_path}/docs",
     redoc_url=f"{settings.base_path}/redoc",
     openapi_url=f"{settings.base_path}/openapi.json",
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -37,66 +49,132 @@ app.include_router(chat_router, prefix=settings.base_path)
 app.include_router(user_router, prefix=settings.base_path)
 app.include_router(websocket_router, prefix=settings.base_path)
 
+app.add_middleware(QueryStatsMiddleware)
+
+if get_database_settings().replica_connection_strings:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router, prefix=settings.base_path)
+
+
+@app.on_event("startup")
+def load_token_keys():
+    get_signing_key()
+    get_verification_keys()
+
+
+@app.on_event("startup")
+async def load_redis_scripts():
+    await get_membership_storage().load_scripts()
+
+
+@app.on_event("shutdown")
+async def close_broadcast_backend():
+    await CHATS_MANAGER.backend.close()
+
+
+@app.on_event("shutdown")
+async def close_token_storage():
+    await get_token_storage().close()
+
+
+@app.on_event("shutdown")
+def close_password_hasher():
+    get_password_hasher().close()
+
+
+@app.on_event("shutdown")
+async def close_redis_client():
+    # Runs after backends above are closed, they share the client
+    if get_redis_client.cache_info().currsize:
+        await get_redis_client().close()
+
 
 @app.exception_handler(AlreadyExistsError)
 def already_exists_exception_handler(request, exc: AlreadyExistsError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_409_CONFLICT,
     )
 
 
 @app.exception_handler(ConstraintError)
 def constraint_exception_handler(request, exc: ConstraintError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_400_BAD_REQUEST,
     )
 
 
 @app.exception_handler(CrudError)
 def crud_exception_handler(request, exc: CrudError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
 
 
+@app.exception_handler(NotModifiedError)
+def not_modified_exception_handler(request, exc: NotModifiedError):
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers=exc.headers
+    )
+
+
+@app.exception_handler(BadRequestError)
+def bad_request_exception_handler(request, exc: BadRequestError):
+    return ORJSONResponse(
+        {"detail": exc.public_message},
+        status_code=status.HTTP_400_BAD_REQUEST,
+    )
+
+
 @app.exception_handler(NotFoundError)
 def not_found_exception_handler(request, exc: NotFoundError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_404_NOT_FOUND,
     )
 
 
 @app.exception_handler(WrongCredentialsError)
 def credentials_exception_handler(request, exc: WrongCredentialsError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_400_BAD_REQUEST,
     )
 
 
 @app.exception_handler(UnauthorizedError)
 def unauthorized_exception_handler(request, exc: UnauthorizedError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_401_UNAUTHORIZED,
     )
 
 
+@app.exception_handler(OverloadedError)
+def overloaded_exception_handler(request, exc: OverloadedError):
+    return ORJSONResponse(
+        {"detail": exc.public_message},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.exception_handler(ServiceError)
 def service_exception_handler(request, exc: ServiceError):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
 
 
 @app.exception_handler(GeneralException)
 def general_exception_handler(request, exc: GeneralException):
-    return Response(
-        json.dumps({"detail": exc.public_message}),
+    return ORJSONResponse(
+        {"detail": exc.public_message},
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
@@ -1,15 +1,18 @@
 from typing import Iterable
 
 from fastapi import APIRouter, Depends, Response, status
+from fastapi.responses import StreamingResponse
 
 from app.schemas.chat_schemas import ChatGetSchema
 from app.schemas.message_schemas import MessageGetSchema
 from app.schemas.user_schemas import UserGetSchema
 from app.services.chat_service import (add_user_service, create_chat_service,
-                                       get_chat_by_id_service,
+                                       get_chat_service,
                                        get_chat_users_service,
                                        get_user_chats_service)
 from app.services.message_service import (create_message_service,
+                                          create_messages_service,
+                                          export_messages_service,
                                           get_messages_service)
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
@@ -48,6 +51,18 @@ async def create_message(
     return message
 
 
+@router.post(
+    "/{chat_id}/messages",
+    response_model=list[MessageGetSchema],
+    summary="Отправка нескольких сообщений в чат",
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_messages(
+    messages: list[MessageGetSchema] = Depends(create_messages_service),
+):
+    return messages
+
+
 @router.get(
     "/{chat_id}/messages",
     response_model=list[MessageGetSchema],
@@ -60,6 +75,17 @@ def get_messages(
     return message
 
 
+@router.get(
+    "/{chat_id}/export",
+    response_class=StreamingResponse,
+    summary="Выгрузка всех сообщений чата в NDJSON",
+    status_code=status.HTTP_200_OK,
+)
+def export_messages(export=Depends(export_messages_service)):
+    # Response annotated parameters aren't allowed with Depends
+    return export
+
+
 @router.get(
     "/my_chats",
     response_model=list[ChatGetSchema],
@@ -78,7 +104,7 @@ def get_user_chats(
     summary="Получение чата по id",
     status_code=status.HTTP_200_OK,
 )
-def get_chat(chat: ChatGetSchema = Depends(get_chat_by_id_service)):
+def get_chat(chat: ChatGetSchema = Depends(get_chat_service)):
     return chat
 
 
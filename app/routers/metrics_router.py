@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, Response, status
+
+from app.services.metrics_service import metrics_service
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get(
+    "/metrics",
+    summary="Метрики сервиса в формате Prometheus",
+    status_code=status.HTTP_200_OK,
+    include_in_schema=False,
+)
+def metrics(metrics: tuple[bytes, str] = Depends(metrics_service)):
+    content, media_type = metrics
+    return Response(content, headers={"Content-Type": media_type})
@@ -1,5 +1,3 @@
-from typing import Iterable
-
 from fastapi import APIRouter, Depends, status
 
 from app.schemas.user_schemas import UserGetSchema
@@ -41,9 +39,9 @@ def update_user(user: UserGetSchema = Depends(update_user_service)):
 
 @router.get(
     "/",
-    response_model=Iterable[UserGetSchema],
+    response_model=list[UserGetSchema],
     summary="Поиск пользователя по логину",
     status_code=status.HTTP_200_OK,
 )
-def search_user(user: UserGetSchema = Depends(search_user_service)):
-    return user
+def search_user(users: list[UserGetSchema] = Depends(search_user_service)):
+    return users
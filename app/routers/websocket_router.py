@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends
 
-from app.services.message_service import connect_message_websocket_service
+from app.services.message_service import (connect_message_websocket_service,
+                                          connect_user_websocket_service)
 
 router = APIRouter(prefix="/ws", tags=["Chat"])
 
@@ -10,3 +11,10 @@ async def message_websocket(
     _: None = Depends(connect_message_websocket_service),
 ):
     pass
+
+
+@router.websocket("/user")
+async def user_websocket(
+    _: None = Depends(connect_user_websocket_service),
+):
+    pass
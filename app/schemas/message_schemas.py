@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Literal
 
 import pytz
 from pydantic import BaseModel, validator
@@ -15,6 +16,24 @@ class MessageCreateSchema(MessageBaseSchema):
     pass
 
 
+class MessageSendSchema(MessageCreateSchema):
+    """
+    Message sent through websocket, id is generated by client
+    and returned in ack or error frame
+    """
+
+    type: Literal["message"]
+    id: str
+    chat_id: int | None = None
+
+
+class ChatSubscribeSchema(BaseModel):
+    """Frame changing chats listened to by user websocket"""
+
+    type: Literal["subscribe", "unsubscribe"]
+    chat_id: int
+
+
 class MessageGetSchema(MessageBaseSchema):
     id: int
     chat_id: int
@@ -1,25 +1,35 @@
 from datetime import datetime, timedelta
+from hashlib import sha256
 from uuid import uuid4
 
 from fastapi import Cookie, Depends, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import ExpiredSignatureError, JWTError, jwt
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.crud.user import create_user, get_user_by_id, get_user_by_name
+from app.crud.user import (create_user, get_user_by_name, get_user_info_by_id,
+                           set_user_passhash)
 from app.database.models import User
-from app.dependencies.auth import get_oauth_scheme
-from app.dependencies.clients import RedisTokenStorage, get_token_storage
-from app.dependencies.database import get_db
+from app.dependencies.auth import (get_oauth_scheme, get_signing_key,
+                                   get_token_cache, get_verification_keys)
+from app.dependencies.clients import (RedisTokenStorage, UserCache,
+                                      get_token_storage, get_user_cache)
+from app.dependencies.database import get_async_db
+from app.dependencies.hashing import get_password_hasher
 from app.dependencies.settings import get_auth_settings
 from app.schemas.auth_schemas import Token, TokenPayload
+from app.schemas.user_schemas import UserGetSchema
 from app.services.exceptions import (ServiceError, UnauthorizedError,
                                      WrongCredentialsError)
 
 
-def verify_password(plain_password, hashed_password):
-    return get_auth_settings().pwd_context.verify(
+async def verify_password(
+    plain_password, hashed_password
+) -> tuple[bool, str | None]:
+    return await get_password_hasher().verify_and_update(
         plain_password, hashed_password
     )
 
@@ -28,27 +38,34 @@ def create_token(token_data: TokenPayload) -> str:
     settings = get_auth_settings()
     token = jwt.encode(
         token_data,
-        settings.private_key.encode("ascii"),
+        get_signing_key(),
         algorithm=settings.algorithm,
+        headers={"kid": settings.key_id},
     )
     return token
 
 
-def authenticate_user(
+async def authenticate_user(
     user_schema: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> User | None:
-    if not (user := get_user_by_name(user_schema.username, db)):
+    if not (user := await get_user_by_name(user_schema.username, db)):
         return None
 
-    if not verify_password(user_schema.password, user.passhash):
+    verified, new_hash = await verify_password(
+        user_schema.password, user.passhash
+    )
+    if not verified:
         return None
+    if new_hash:
+        await set_user_passhash(user, new_hash, db)
+        await db.commit()
 
     return user
 
 
 def create_token_pair(
-    user: User | None = Depends(authenticate_user),
+    user: User | UserGetSchema | Row | None = Depends(authenticate_user),
 ) -> tuple[str, str]:
     if user is None:
         raise UnauthorizedError("Wrong username or password")
@@ -89,15 +106,24 @@ def signin_service(
 def decode_token_payload(
     token: str = Depends(get_oauth_scheme()),
 ) -> dict[str, any]:
-    settings = get_auth_settings()
+    cache = get_token_cache()
+    cache_key = sha256(token.encode()).digest()
+    if payload := cache.get(cache_key):
+        return payload
+    key_id = get_auth_settings().key_id
     try:
-        return jwt.decode(
-            token, settings.public_key, algorithms=[settings.algorithm]
-        )
+        key_id = jwt.get_unverified_header(token).get("kid", key_id)
+        key, algorithm = get_verification_keys()[key_id]
+        payload = jwt.decode(token, key, algorithms=[algorithm])
+    except KeyError as exc:
+        raise ServiceError("Wrong token") from exc
     except ExpiredSignatureError as exc:
         raise UnauthorizedError("Token expired") from exc
     except (JWTError, ValidationError) as exc:
         raise ServiceError("Wrong token") from exc
+    if isinstance(payload.get("exp"), int):
+        cache.set(cache_key, payload, payload["exp"])
+    return payload
 
 
 def decode_token(
@@ -106,41 +132,48 @@ def decode_token(
     return TokenPayload(**token_payload)
 
 
-def is_token_not_invalidated(
+async def is_token_not_invalidated(
     token_payload: TokenPayload = Depends(decode_token),
     token_storage: RedisTokenStorage = Depends(get_token_storage),
 ) -> bool:
-    if token_storage.has_token(token_payload):
+    if await token_storage.has_token(token_payload):
         raise UnauthorizedError("Token invalidated")
     return True
 
 
-def get_current_user(
+async def get_current_user(
     _: bool = Depends(is_token_not_invalidated),
     token_payload: TokenPayload = Depends(decode_token),
-    db: Session = Depends(get_db),
-) -> User:
+    db: AsyncSession = Depends(get_async_db),
+    user_cache: UserCache = Depends(get_user_cache),
+) -> UserGetSchema:
     user_id = token_payload.sub
     username = token_payload.name
     if user_id is None or username is None:
         raise WrongCredentialsError("Wrong token")
 
-    user = get_user_by_id(user_id, db)
+    user = await user_cache.get(int(user_id))
+    if user is None:
+        user = await get_user_info_by_id(int(user_id), db)
+        if user is not None:
+            await user_cache.set(user)
     if user is None or user.username != username:
         raise WrongCredentialsError("No such user")
     return user
 
 
-def create_tokens_from_refresh(
+async def create_tokens_from_refresh(
     Authorization: str | None = Cookie(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if not Authorization:
         raise UnauthorizedError("No refresh token")
 
     token_data = decode_token_payload(Authorization)
-    user = get_current_user(True, TokenPayload(**token_data), db)
-    return create_token_pair(user)
+    user = await get_current_user(
+        True, TokenPayload(**token_data), db, get_user_cache()
+    )
+    return await run_in_threadpool(create_token_pair, user)
 
 
 def refresh_service(
@@ -152,19 +185,27 @@ def refresh_service(
     return Token(access_token=access_token)
 
 
+async def register_user(
+    user: Row = Depends(create_user),
+    db: AsyncSession = Depends(get_async_db),
+) -> Row:
+    await db.commit()
+    return user
+
+
 def signup_service(
-    response: Response, user: User = Depends(create_user)
+    response: Response, user: Row = Depends(register_user)
 ) -> Token:
     access_token, refresh_token = create_token_pair(user)
     response.set_cookie(key="Authorization", value=refresh_token)
     return Token(access_token=access_token)
 
 
-def invalidate_access_token(
+async def invalidate_access_token(
     token_payload: TokenPayload = Depends(decode_token),
     token_storage: RedisTokenStorage = Depends(get_token_storage),
 ) -> None:
-    token_storage.add_token(token_payload)
+    await token_storage.add_token(token_payload)
 
 
 def logout_service(_: None = Depends(invalidate_access_token)) -> None:
@@ -1,70 +1,133 @@
-from typing import Iterable
-
-from fastapi import Depends
-from sqlalchemy.orm import Session
+from fastapi import Depends, Header, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.crud.chat import (add_user_to_chat, create_chat, get_chat_by_id,
-                           user_in_chat)
-from app.database.models import Chat, User
-from app.dependencies.database import get_db
+                           get_chat_users, get_user_chat_ids, get_user_chats)
+from app.database.models import Chat
+from app.dependencies.clients import (ChatSocketsManager,
+                                      RedisMembershipStorage,
+                                      get_chats_manager,
+                                      get_membership_storage)
+from app.dependencies.database import get_async_db, get_async_read_db
 from app.schemas.chat_schemas import (AddUserSchema, ChatCreateSchema,
                                       ChatGetSchema)
 from app.schemas.user_schemas import UserGetSchema
 from app.services.auth_service import get_current_user
+from app.services.etag import check_etag, make_etag
 from app.services.exceptions import NotFoundError
 
 
-def create_chat_service(
+async def check_chat_members(
+    pairs: list[tuple[int, int]],
+    db: AsyncSession,
+    membership: RedisMembershipStorage,
+) -> list[bool]:
+    """
+    Checks (user_id, chat_id) pairs against membership index,
+    users missing in index are loaded from database with one query
+    """
+    cached = await membership.has_members(pairs)
+    missing = {
+        user_id: version
+        for (user_id, _), (is_member, version) in zip(pairs, cached)
+        if is_member is None
+    }
+    chat_ids = {}
+    if missing:
+        chat_ids = await get_user_chat_ids(missing, db)
+        for user_id, version in missing.items():
+            await membership.set_chats(user_id, chat_ids[user_id], version)
+    return [
+        chat_id in chat_ids[user_id] if is_member is None else is_member
+        for (user_id, chat_id), (is_member, _) in zip(pairs, cached)
+    ]
+
+
+async def user_in_chat(
+    user_id: int,
+    chat_id: int,
+    db: AsyncSession,
+    membership: RedisMembershipStorage,
+) -> bool:
+    return (await check_chat_members([(user_id, chat_id)], db, membership))[0]
+
+
+async def create_chat_service(
     chat_schema: ChatCreateSchema,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: UserGetSchema = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    membership: RedisMembershipStorage = Depends(get_membership_storage),
+    sockets: ChatSocketsManager = Depends(get_chats_manager),
 ) -> ChatGetSchema:
-    chat = create_chat(chat_schema, db)
-    add_user_to_chat(chat.id, AddUserSchema(user_id=user.id), db)
+    chat = await create_chat(chat_schema, db)
+    await add_user_to_chat(chat.id, AddUserSchema(user_id=user.id), db)
+    await db.commit()
+    await membership.add_member(user.id, chat.id)
+    await sockets.add_member(user.id, chat.id)
     return ChatGetSchema.from_orm(chat)
 
 
-def add_user_service(
+async def add_user_service(
     chat_id: int,
     schema: AddUserSchema,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: UserGetSchema = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    membership: RedisMembershipStorage = Depends(get_membership_storage),
+    sockets: ChatSocketsManager = Depends(get_chats_manager),
 ) -> None:
-    if not user_in_chat(user.id, chat_id, db):
+    if not await user_in_chat(user.id, chat_id, db, membership):
         raise NotFoundError("No chat")
-    add_user_to_chat(chat_id, schema, db)
+    await add_user_to_chat(chat_id, schema, db)
+    await db.commit()
+    await membership.add_member(schema.user_id, chat_id)
+    await sockets.add_member(schema.user_id, chat_id)
     return
 
 
-def get_chat_by_id_service(
-    user: User = Depends(get_current_user),
+async def get_chat_by_id_service(
+    user: UserGetSchema = Depends(get_current_user),
     chat: Chat = Depends(get_chat_by_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    membership: RedisMembershipStorage = Depends(get_membership_storage),
 ) -> ChatGetSchema:
     if chat is None:
         raise NotFoundError("No chat")
-    if user_in_chat(user.id, chat.id, db):
+    if await user_in_chat(user.id, chat.id, db, membership):
         return ChatGetSchema.from_orm(chat)
     raise NotFoundError("No chat")
 
 
-def get_user_chats_service(
-    user: User = Depends(get_current_user),
-) -> Iterable[ChatGetSchema]:
-    return (ChatGetSchema.from_orm(user_chat.chat) for user_chat in user.chats)
+async def get_chat_service(
+    response: Response,
+    if_none_match: str | None = Header(None),
+    chat: ChatGetSchema = Depends(get_chat_by_id_service),
+) -> ChatGetSchema:
+    check_etag(response, if_none_match, make_etag("chat", chat.id, chat.name))
+    return chat
+
+
+async def get_user_chats_service(
+    page_size: int = Query(100, ge=1, le=500),
+    after: int | None = None,
+    user: UserGetSchema = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+) -> list[ChatGetSchema]:
+    return await get_user_chats(user.id, page_size, after, db)
 
 
-def get_chat_users_service(
-    user: User = Depends(get_current_user),
+async def get_chat_users_service(
+    page_size: int = Query(100, ge=1, le=500),
+    after: int | None = None,
+    user: UserGetSchema = Depends(get_current_user),
     chat: Chat = Depends(get_chat_by_id),
-    db: Session = Depends(get_db),
-) -> Iterable[UserGetSchema]:
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_async_read_db),
+    membership: RedisMembershipStorage = Depends(get_membership_storage),
+) -> list[UserGetSchema]:
     if chat is None:
         raise NotFoundError("No chat")
-    if user_in_chat(user.id, chat.id, db):
-        return (
-            UserGetSchema.from_orm(user_chat.user) for user_chat in chat.users
-        )
+    if await user_in_chat(user.id, chat.id, db, membership):
+        return await get_chat_users(chat.id, page_size, after, read_db)
     raise NotFoundError("No chat")
 
 
@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from hashlib import blake2b
+
+from fastapi import Response
+
+from app.services.exceptions import NotModifiedError
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from values identifying current representation"""
+    value = ":".join(str(part) for part in parts).encode()
+    return f'"{blake2b(value, digest_size=12).hexdigest()}"'
+
+
+def check_etag(
+    response: Response,
+    if_none_match: str | None,
+    etag: str,
+    last_modified: datetime | None = None,
+):
+    """
+    Sets validators on response or raises NotModifiedError
+    if client already has current representation
+    """
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    if if_none_match is not None:
+        tags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        if etag in tags or "*" in tags:
+            raise NotModifiedError(headers)
+    response.headers.update(headers)
@@ -20,7 +20,30 @@ class WrongCredentialsError(ServiceError):
     """
 
 
+class BadRequestError(ServiceError):
+    """
+    Exception raised when request is well formed but can't be accepted
+    i.e. exceeds configured limits
+    """
+
+
 class NotFoundError(ServiceError):
     """
     Exception raised when can't find requested entity
     """
+
+
+class NotModifiedError(ServiceError):
+    """
+    Exception raised when client's cached representation is still current
+    """
+
+    def __init__(self, headers: dict[str, str], *args, **kwargs):
+        self.headers = headers
+        super().__init__("Not modified", *args, **kwargs)
+
+
+class OverloadedError(ServiceError):
+    """
+    Exception raised when service can't accept more work right now
+    """
@@ -1,67 +1,344 @@
-from typing import Iterable
+import time
+import zlib
+from typing import AsyncIterator, Iterable, Literal
 
-from fastapi import Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import Depends, Header, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError, parse_raw_as
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.crud.chat import get_chat_by_id
-from app.crud.message import create_message, get_messages
-from app.database.models import Message, User
-from app.dependencies.clients import (ChatSocketsManager, RedisTokenStorage,
-                                      get_token_storage)
-from app.dependencies.database import get_db
+from app.crud.chat import get_chat_by_id, get_user_chat_ids
+from app.crud.message import (create_message, create_messages,
+                              get_last_message, get_messages, stream_messages)
+from app.dependencies.clients import (RedisMembershipStorage,
+                                      RedisTokenStorage, UserCache,
+                                      WebsocketConnection, get_chats_manager,
+                                      get_membership_storage,
+                                      get_token_storage, get_user_cache)
+from app.dependencies.database import get_async_db, get_async_read_db
+from app.dependencies.settings import get_chat_settings
+from app.exceptions import GeneralException
+from app.schemas.auth_schemas import TokenPayload
 from app.schemas.chat_schemas import ChatGetSchema
-from app.schemas.message_schemas import MessageCreateSchema, MessageGetSchema
+from app.schemas.message_schemas import (ChatSubscribeSchema,
+                                         MessageCreateSchema, MessageGetSchema,
+                                         MessageSendSchema)
+from app.schemas.user_schemas import UserGetSchema
 from app.services.auth_service import (decode_token, decode_token_payload,
                                        get_current_user,
                                        is_token_not_invalidated)
-from app.services.chat_service import get_chat_by_id_service
+from app.services.chat_service import get_chat_by_id_service, user_in_chat
+from app.services.etag import check_etag, make_etag
+from app.services.exceptions import BadRequestError, UnauthorizedError
 
-CHATS_MANAGER = ChatSocketsManager()
+CHATS_MANAGER = get_chats_manager()
 
 
 async def create_message_service(
     schema: MessageCreateSchema,
-    user: User = Depends(get_current_user),
+    user: UserGetSchema = Depends(get_current_user),
     chat: ChatGetSchema = Depends(get_chat_by_id_service),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> MessageGetSchema:
-    message = create_message(user.id, chat.id, schema, db)
+    message = await create_message(user.id, chat.id, schema, db)
+    await db.commit()
     schema = MessageGetSchema.from_orm(message)
     await CHATS_MANAGER.send_message(chat.id, schema)
     return schema
 
 
-def get_messages_service(
-    user: User = Depends(get_current_user),
+def validate_message_batch(
+    schemas: list[MessageCreateSchema],
+) -> list[MessageCreateSchema]:
+    settings = get_chat_settings()
+    if not schemas:
+        raise BadRequestError("Batch is empty")
+    if len(schemas) > settings.message_batch_max_size:
+        raise BadRequestError(
+            f"Batch can't contain more than "
+            f"{settings.message_batch_max_size} messages"
+        )
+    length = sum(len(schema.content) for schema in schemas)
+    if length > settings.message_batch_max_length:
+        raise BadRequestError(
+            f"Batch content can't be longer than "
+            f"{settings.message_batch_max_length} characters"
+        )
+    return schemas
+
+
+async def create_messages_service(
+    schemas: list[MessageCreateSchema] = Depends(validate_message_batch),
+    user: UserGetSchema = Depends(get_current_user),
+    chat: ChatGetSchema = Depends(get_chat_by_id_service),
+    db: AsyncSession = Depends(get_async_db),
+) -> list[MessageGetSchema]:
+    rows = await create_messages(user.id, chat.id, schemas, db)
+    await db.commit()
+    messages = [MessageGetSchema.from_orm(row) for row in rows]
+    await CHATS_MANAGER.send_messages(chat.id, messages)
+    return messages
+
+
+async def get_messages_service(
+    response: Response,
+    page_size: int = 100,
+    start: int | None = None,
+    after: int | None = None,
+    around: int | None = None,
+    if_none_match: str | None = Header(None),
+    user: UserGetSchema = Depends(get_current_user),
     chat: ChatGetSchema = Depends(get_chat_by_id_service),
-    messages: Iterable[Message] = Depends(get_messages),
+    db: AsyncSession = Depends(get_async_read_db),
 ) -> Iterable[MessageGetSchema]:
+    if start is None and after is None and around is None:
+        # Latest page changes only when new message is sent
+        last = await get_last_message(chat.id, db)
+        check_etag(
+            response,
+            if_none_match,
+            make_etag("messages", chat.id, page_size, last and last.id),
+            last and last.date_send,
+        )
+    messages = await get_messages(chat.id, page_size, start, after, around, db)
     return (MessageGetSchema.from_orm(message) for message in messages)
 
 
+async def export_messages_service(
+    gzip: bool = False,
+    user: UserGetSchema = Depends(get_current_user),
+    chat: ChatGetSchema = Depends(get_chat_by_id_service),
+    db: AsyncSession = Depends(get_async_db),
+) -> StreamingResponse:
+    """
+    Chat history as NDJSON, one message per line. Rows are encoded and
+    sent batch by batch, so memory use doesn't depend on chat size
+    """
+    batch_size = get_chat_settings().export_batch_size
+
+    async def lines() -> AsyncIterator[bytes]:
+        async for rows in stream_messages(chat.id, batch_size, db):
+            yield b"".join(
+                orjson.dumps(MessageGetSchema.from_orm(row).dict()) + b"\n"
+                for row in rows
+            )
+
+    async def compressed() -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        async for chunk in lines():
+            if data := compressor.compress(chunk):
+                yield data
+        yield compressor.flush()
+
+    filename = f"chat-{chat.id}.ndjson"
+    if gzip:
+        return StreamingResponse(
+            compressed(),
+            media_type="application/gzip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}.gz"'
+            },
+        )
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+async def authenticate_websocket(
+    token: str,
+    db: AsyncSession,
+    token_storage: RedisTokenStorage,
+    user_cache: UserCache,
+) -> tuple[TokenPayload, UserGetSchema]:
+    payload = decode_token_payload(token)
+    payload = decode_token(payload)
+    await is_token_not_invalidated(payload, token_storage)
+    user = await get_current_user(True, payload, db, user_cache)
+    return payload, user
+
+
 async def connect_message_websocket_service(
     token: str,
     chat_id: int,
     websocket: WebSocket,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     token_storage: RedisTokenStorage = Depends(get_token_storage),
+    user_cache: UserCache = Depends(get_user_cache),
+    membership: RedisMembershipStorage = Depends(get_membership_storage),
 ):
     try:
-        payload = decode_token_payload(token)
-        payload = decode_token(payload)
-        is_token_not_invalidated(payload, token_storage)
-        user = get_current_user(True, payload, db)
-        chat = get_chat_by_id(chat_id, db)
-        get_chat_by_id_service(user, chat, db)
+        payload, user = await authenticate_websocket(
+            token, db, token_storage, user_cache
+        )
+        chat = await get_chat_by_id(chat_id, db)
+        await get_chat_by_id_service(user, chat, db, membership)
     except Exception:
         await websocket.accept()
         await websocket.close(4004, "Chat not found")
         return
-    await CHATS_MANAGER.add_user(websocket, chat_id)
+    finally:
+        # Release pooled connection, socket may stay open for hours
+        await db.close()
+    try:
+        await CHATS_MANAGER.connect(websocket, user.id, [chat_id])
+        while True:
+            msg = await websocket.receive()
+            if msg.get("type") == "websocket.disconnect":
+                raise WebSocketDisconnect
+            if not (text := msg.get("text")):
+                continue
+            try:
+                frame = MessageSendSchema.parse_raw(text)
+            except ValidationError:
+                send_error(websocket, None, "Invalid frame")
+                continue
+            await store_message_frame(
+                frame, chat_id, websocket, user, payload, db, token_storage
+            )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await CHATS_MANAGER.disconnect(websocket)
+
+
+async def connect_user_websocket_service(
+    token: str,
+    websocket: WebSocket,
+    subscribe: Literal["all", "none"] = "all",
+    db: AsyncSession = Depends(get_async_db),
+    token_storage: RedisTokenStorage = Depends(get_token_storage),
+    user_cache: UserCache = Depends(get_user_cache),
+    membership: RedisMembershipStorage = Depends(get_membership_storage),
+):
+    """
+    Single socket for all chats of user. With subscribe=all listens to
+    every chat of user including ones user is added to later,
+    with subscribe=none chats are chosen by subscribe frames
+    """
+    try:
+        payload, user = await authenticate_websocket(
+            token, db, token_storage, user_cache
+        )
+        chat_ids = set()
+        if subscribe == "all":
+            chat_ids = (await get_user_chat_ids([user.id], db))[user.id]
+    except Exception:
+        await websocket.accept()
+        await websocket.close(4001, "Unauthorized")
+        return
+    finally:
+        await db.close()
     try:
+        connection = await CHATS_MANAGER.connect(
+            websocket, user.id, chat_ids, follow=subscribe == "all"
+        )
         while True:
             msg = await websocket.receive()
             if msg.get("type") == "websocket.disconnect":
                 raise WebSocketDisconnect
+            if not (text := msg.get("text")):
+                continue
+            try:
+                frame = parse_raw_as(
+                    MessageSendSchema | ChatSubscribeSchema, text
+                )
+            except ValidationError:
+                send_error(websocket, None, "Invalid frame")
+                continue
+            if isinstance(frame, ChatSubscribeSchema):
+                await change_subscription(
+                    frame, connection, user, db, membership
+                )
+            elif frame.chat_id not in connection.chat_ids:
+                send_error(websocket, frame.id, "Not subscribed to chat")
+            else:
+                await store_message_frame(
+                    frame,
+                    frame.chat_id,
+                    websocket,
+                    user,
+                    payload,
+                    db,
+                    token_storage,
+                )
     except WebSocketDisconnect:
-        CHATS_MANAGER.remove_user(websocket, chat_id)
+        pass
+    finally:
+        await CHATS_MANAGER.disconnect(websocket)
+
+
+async def change_subscription(
+    frame: ChatSubscribeSchema,
+    connection: WebsocketConnection,
+    user: UserGetSchema,
+    db: AsyncSession,
+    membership: RedisMembershipStorage,
+):
+    if frame.type == "unsubscribe":
+        await CHATS_MANAGER.unsubscribe(connection, frame.chat_id)
+        CHATS_MANAGER.send_to(
+            connection.websocket,
+            {"type": "unsubscribed", "chat_id": frame.chat_id},
+        )
+        return
+    try:
+        member = await user_in_chat(user.id, frame.chat_id, db, membership)
+    finally:
+        await db.close()
+    if not member:
+        send_error(connection.websocket, None, "No chat")
+        return
+    await CHATS_MANAGER.subscribe(connection, frame.chat_id)
+    CHATS_MANAGER.send_to(
+        connection.websocket,
+        {"type": "subscribed", "chat_id": frame.chat_id},
+    )
+
+
+def send_error(websocket: WebSocket, frame_id: str | None, detail: str):
+    CHATS_MANAGER.send_to(
+        websocket, {"type": "error", "id": frame_id, "detail": detail}
+    )
+
+
+async def store_message_frame(
+    frame: MessageSendSchema,
+    chat_id: int,
+    websocket: WebSocket,
+    user: UserGetSchema,
+    payload: TokenPayload,
+    db: AsyncSession,
+    token_storage: RedisTokenStorage,
+):
+    """
+    Stores message received through websocket authenticated on connect,
+    sender gets ack with client id besides the usual broadcast
+    """
+    try:
+        if payload.exp <= time.time():
+            raise UnauthorizedError("Token expired")
+        await is_token_not_invalidated(payload, token_storage)
+        message = await create_message(
+            user.id, chat_id, MessageCreateSchema(content=frame.content), db
+        )
+        await db.commit()
+    except (GeneralException, SQLAlchemyError) as exc:
+        detail = getattr(exc, "public_message", "Couldn't send message")
+        send_error(websocket, frame.id, detail)
+        return
+    finally:
+        await db.close()
+    schema = MessageGetSchema.from_orm(message)
+    await CHATS_MANAGER.send_message(chat_id, schema)
+    CHATS_MANAGER.send_to(
+        websocket,
+        {
+            "type": "ack",
+            "id": frame.id,
+            "message": schema.dict(),
+        },
+    )
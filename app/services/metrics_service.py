@@ -0,0 +1,91 @@
+from anyio.to_thread import current_default_thread_limiter
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.pool import QueuePool
+
+from app.dependencies.auth import get_token_cache
+from app.dependencies.clients import get_chats_manager
+from app.dependencies.database import (get_async_replica_engines,
+                                       get_async_sql_alchemy_engine,
+                                       get_sql_alchemy_engine)
+from app.dependencies.metrics import (DB_POOL_CONNECTIONS, THREADPOOL_THREADS,
+                                      WEBSOCKET_CHAT_CONNECTIONS,
+                                      WEBSOCKET_CONNECTIONS)
+
+
+def update_pool_gauges():
+    engines = {
+        "async": (
+            get_async_sql_alchemy_engine,
+            lambda: get_async_sql_alchemy_engine().sync_engine,
+        ),
+        "sync": (get_sql_alchemy_engine, get_sql_alchemy_engine),
+    }
+    if get_async_replica_engines.cache_info().currsize:
+        for index, replica in enumerate(get_async_replica_engines()):
+            engines[f"replica-{index}"] = (
+                get_async_replica_engines,
+                lambda replica=replica: replica.sync_engine,
+            )
+    for name, (getter, engine) in engines.items():
+        # Don't create engine just to report it
+        if getter.cache_info().currsize == 0:
+            continue
+        pool = engine().pool
+        if not isinstance(pool, QueuePool):
+            continue
+        DB_POOL_CONNECTIONS.labels(name, "size").set(pool.size())
+        DB_POOL_CONNECTIONS.labels(name, "checked_out").set(pool.checkedout())
+        DB_POOL_CONNECTIONS.labels(name, "checked_in").set(pool.checkedin())
+        DB_POOL_CONNECTIONS.labels(name, "overflow").set(
+            max(pool.overflow(), 0)
+        )
+
+
+class TokenCacheCollector(Collector):
+    """
+    Hits and misses of verified token cache. Cache keeps its own counters,
+    so they are read at scrape time instead of being mirrored on lookup
+    """
+
+    def collect(self):
+        cache = get_token_cache()
+        yield CounterMetricFamily(
+            "token_cache_hits",
+            "Tokens answered from verified token cache",
+            value=cache.hits,
+        )
+        yield CounterMetricFamily(
+            "token_cache_misses",
+            "Tokens decoded and verified on request",
+            value=cache.misses,
+        )
+
+
+REGISTRY.register(TokenCacheCollector())
+
+
+def update_threadpool_gauges():
+    limiter = current_default_thread_limiter()
+    THREADPOOL_THREADS.labels("busy").set(limiter.borrowed_tokens)
+    THREADPOOL_THREADS.labels("total").set(limiter.total_tokens)
+
+
+def update_websocket_gauges():
+    manager = get_chats_manager()
+    WEBSOCKET_CONNECTIONS.set(len(manager.connections))
+    WEBSOCKET_CHAT_CONNECTIONS.clear()
+    for chat_id, connections in list(manager.chats.items()):
+        WEBSOCKET_CHAT_CONNECTIONS.labels(chat_id).set(len(connections))
+
+
+async def metrics_service() -> tuple[bytes, str]:
+    """
+    Gauges are read at scrape time, so request path only pays
+    for histograms and counters
+    """
+    update_pool_gauges()
+    update_threadpool_gauges()
+    update_websocket_gauges()
+    return generate_latest(), CONTENT_TYPE_LATEST
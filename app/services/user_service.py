@@ -1,38 +1,79 @@
-from typing import Iterable
+import time
+from typing import Literal
 
-from fastapi import Depends
-from sqlalchemy.orm import Session
+from fastapi import Depends, Header, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.crud.user import get_user_by_id, search_user, update_user
-from app.database.models import User
-from app.dependencies.database import get_db
+from app.crud.user import get_user_info_by_id, search_user, update_user
+from app.dependencies.cache import TTLCache, get_search_cache
+from app.dependencies.clients import UserCache, get_user_cache
+from app.dependencies.database import get_async_db, get_async_read_db
+from app.dependencies.settings import get_fastapi_settings
 from app.schemas.user_schemas import UserGetSchema, UserUpdateSchema
 from app.services.auth_service import get_current_user
+from app.services.etag import check_etag, make_etag
 from app.services.exceptions import NotFoundError
 
 
-def me_service(user: User = Depends(get_current_user)) -> UserGetSchema:
-    return UserGetSchema.from_orm(user)
+async def me_service(
+    user: UserGetSchema = Depends(get_current_user),
+) -> UserGetSchema:
+    return user
 
 
-def user_by_id_service(
-    user: User | None = Depends(get_user_by_id),
+async def user_by_id_service(
+    user_id: int,
+    response: Response,
+    if_none_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_async_read_db),
+    user_cache: UserCache = Depends(get_user_cache),
 ) -> UserGetSchema:
+    user = await user_cache.get(user_id)
     if user is None:
-        raise NotFoundError("Couldn't find user")
-    return UserGetSchema.from_orm(user)
+        user = await get_user_info_by_id(user_id, db)
+        if user is None:
+            raise NotFoundError("Couldn't find user")
+        await user_cache.set(user)
+    check_etag(response, if_none_match, make_etag("user", user.json()))
+    return user
 
 
-def update_user_service(
+async def update_user_service(
     user_schema: UserUpdateSchema,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: UserGetSchema = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user_cache: UserCache = Depends(get_user_cache),
 ) -> UserGetSchema:
-    user = update_user(user_schema, user, db)
-    return UserGetSchema.from_orm(user)
+    db_user = await update_user(user.id, user_schema, db)
+    if db_user is None:
+        raise NotFoundError("Couldn't find user")
+    await db.commit()
+    user = UserGetSchema.from_orm(db_user)
+    await user_cache.set(user)
+    return user
+
 
+async def search_user_service(
+    match: str | None = None,
+    limit: int = Query(5, ge=1, le=100),
+    mode: Literal["contains", "prefix"] = "contains",
+    after: int | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    search_cache: TTLCache = Depends(get_search_cache),
+) -> list[UserGetSchema]:
+    # First pages of prefix search repeat on every keystroke
+    cacheable = bool(match) and mode == "prefix" and after is None
+    if cacheable:
+        key = (match.lower(), limit)
+        if (users := search_cache.get(key)) is not None:
+            return users
 
-def search_user_service(
-    users: Iterable[User] = Depends(search_user),
-) -> Iterable[UserGetSchema]:
-    return (UserGetSchema.from_orm(user) for user in users)
+    users = [
+        UserGetSchema.from_orm(user)
+        for user in await search_user(match, limit, mode, after, db)
+    ]
+    if cacheable:
+        search_cache.set(
+            key, users, time.time() + get_fastapi_settings().search_cache_ttl
+        )
+    return users
@@ -1,20 +1,45 @@
+from typing import Literal
+
 from passlib.context import CryptContext
-from pydantic import BaseSettings, validator
+from pydantic import BaseSettings, Field, validator
 
 
 class AuthSettings(BaseSettings):
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    bcrypt_rounds: int = 12
+    pwd_context: CryptContext | None = None
+    hash_workers: int = 2
+    hash_queue_size: int = 32
     private_key: str
     public_key: str
-    algorithm = "RS256"
+    algorithm: Literal[
+        "RS256", "RS384", "RS512", "ES256", "ES384", "ES512"
+    ] = "RS256"
+    key_id: str = "default"
+    verification_keys: dict[str, str] = {}
     access_token_expire_minutes: int
     refresh_token_expire_days: int
+    token_cache_size: int = 10000
+    user_cache_size: int = 10000
+    user_cache_ttl: int = 30
+    user_cache_redis: bool = False
 
     class Config:
         env_prefix = "jwt_"
         case_sensitive = False
         env_file = ".env"
         env_file_encoding = "utf-8"
+        arbitrary_types_allowed = True
+
+    @validator("pwd_context", always=True)
+    @classmethod
+    def build_pwd_context(cls, value, values):
+        if "bcrypt_rounds" not in values:
+            return value
+        return CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__rounds=values["bcrypt_rounds"],
+        )
 
     @validator("private_key")
     @classmethod
@@ -28,10 +53,27 @@ class AuthSettings(BaseSettings):
         with open(value, "r") as file:
             return file.read()
 
+    @validator("verification_keys")
+    @classmethod
+    def download_verification_keys(cls, value):
+        keys = {}
+        for key_id, path in value.items():
+            with open(path, "r") as file:
+                keys[key_id] = file.read()
+        return keys
+
 
 class DatabaseSettings(BaseSettings):
     connection_string: str
     application_name: str
+    n_plus_one_threshold: int = 10
+    replica_connection_strings: list[str] = []
+    replica_retry_interval: float = 10
+    replica_connect_timeout: float = 2
+    replica_pool_timeout: float = 2
+    replica_connect_timeout: float = 2
+    replica_pool_timeout: float = 2
+    read_your_writes_window: int = 5
 
     class Config:
         env_prefix = "db_"
@@ -42,6 +84,11 @@ class DatabaseSettings(BaseSettings):
 
 class FastApiSettings(BaseSettings):
     base_path: str
+    debug: bool = Field(False, env="debug")
+    broadcast_backend: Literal["memory", "redis"] = "memory"
+    search_cache_size: int = 1000
+    search_cache_ttl: int = 10
+    metrics_enabled: bool = True
 
     class Config:
         env_prefix = "service_"
@@ -50,9 +97,32 @@ class FastApiSettings(BaseSettings):
         env_file_encoding = "utf-8"
 
 
+class ChatSettings(BaseSettings):
+    message_batch_max_size: int = 100
+    message_batch_max_length: int = 100000
+    websocket_queue_size: int = 256
+    websocket_slow_consumer: Literal["drop", "disconnect"] = "disconnect"
+    export_batch_size: int = 1000
+
+    class Config:
+        env_prefix = "chat_"
+        case_sensitive = False
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+
 class RedisSettings(BaseSettings):
     host: str
     password: str
+    port: int = 6379
+    db: int = 0
+    max_connections: int = 50
+    pool_timeout: float = 5
+    socket_timeout: float = 5
+    socket_connect_timeout: float = 5
+    health_check_interval: int = 30
+    revocation_cache: bool = True
+    membership_ttl: int = 3600
 
     class Config:
         env_prefix = "redis_"
@@ -0,0 +1,106 @@
+"""
+Serialization cost of one chat broadcast with many recipients.
+
+Compares the old frame encoder (message.dict(), str() of date_send and
+json.dumps) with dump_frame, both once per broadcast and once per
+recipient. Then measures ChatSocketsManager.send_message to
+``--recipients`` in-memory sockets, from encoding until every socket
+has been handed the frame.
+
+Usage:
+    python -m benchmarks.broadcast_serialization --recipients 1000
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from app.dependencies.clients import ChatSocketsManager, dump_frame
+from app.schemas.message_schemas import MessageGetSchema
+from benchmarks.websocket_latency import summary
+
+
+class NullWebSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.received += 1
+
+    async def close(self, code: int, reason: str):
+        pass
+
+
+def json_frame(message: MessageGetSchema) -> str:
+    msg_dict = message.dict()
+    msg_dict["date_send"] = str(msg_dict["date_send"])
+    return json.dumps(msg_dict)
+
+
+def orjson_frame(message: MessageGetSchema) -> str:
+    return dump_frame(message.dict())
+
+
+def encode_cost(
+    encode: Callable, message: MessageGetSchema, times: int, args
+) -> dict:
+    timings = []
+    for _ in range(args.broadcasts):
+        started = time.perf_counter()
+        for _ in range(times):
+            encode(message)
+        timings.append((time.perf_counter() - started) * 1000)
+    return summary(timings)
+
+
+async def fan_out(message: MessageGetSchema, args) -> dict:
+    manager = ChatSocketsManager()
+    sockets = [NullWebSocket() for _ in range(args.recipients)]
+    for user_id, websocket in enumerate(sockets):
+        await manager.connect(websocket, user_id, [message.chat_id])
+    timings = []
+    for sent in range(1, args.broadcasts + 1):
+        started = time.perf_counter()
+        await manager.send_message(message.chat_id, message)
+        while any(websocket.received < sent for websocket in sockets):
+            await asyncio.sleep(0)
+        timings.append((time.perf_counter() - started) * 1000)
+    for websocket in sockets:
+        await manager.disconnect(websocket)
+    return summary(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--broadcasts", type=int, default=200)
+    parser.add_argument("--content-length", type=int, default=200)
+    args = parser.parse_args()
+    message = MessageGetSchema(
+        id=1,
+        chat_id=1,
+        user_id=1,
+        content="x" * args.content_length,
+        date_send=datetime.now(timezone.utc),
+    )
+    results = {
+        "json_per_broadcast": encode_cost(json_frame, message, 1, args),
+        "orjson_per_broadcast": encode_cost(orjson_frame, message, 1, args),
+        "json_per_recipient": encode_cost(
+            json_frame, message, args.recipients, args
+        ),
+        "orjson_per_recipient": encode_cost(
+            orjson_frame, message, args.recipients, args
+        ),
+        "fan_out": asyncio.run(fan_out(message, args)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+HTTP throughput and latency of the main API routes under concurrent load.
+
+Boots app.main:app with uvicorn in a background thread (or targets
+``--base-url``), seeds ``--users`` users, ``--chats`` chats and
+``--messages`` messages, then runs ``--concurrency`` async clients for
+``--duration`` seconds. Every client signs in once and then picks routes
+from a weighted mix of signin, /user/me, /chat/my_chats, history paging,
+message POST and prefix user search. Prints RPS, errors and latency
+percentiles per route as JSON; ``--save`` stores the report and
+``--baseline`` prints the change against a stored one. Run fails and
+saves nothing when any request failed.
+
+Postgres is taken from DB_CONNECTION_STRING, ``--sqlite`` replaces it
+with a local file for smoke runs. Redis comes from REDIS_* settings,
+``--fake-redis`` uses an in-process fakeredis instead. JWT_* settings
+are required as for the app itself.
+
+Usage:
+    python -m benchmarks.load --duration 30 --save baseline.json
+    python -m benchmarks.load --skip-seed --baseline baseline.json
+    python -m benchmarks.load --sqlite /tmp/load.db --fake-redis \\
+        --users 50 --messages 5000 --duration 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import httpx
+
+from app.dependencies.settings import get_fastapi_settings
+from benchmarks.load import environment
+from benchmarks.load.scenarios import SCENARIOS, Client, signin
+from benchmarks.websocket_latency import summary
+
+
+async def client_loop(
+    base_url: str,
+    username: str,
+    chat_ids: list[int],
+    scenarios: dict,
+    deadline: float,
+    latencies: dict[str, list[float]],
+    errors: dict[str, int],
+    seed: int,
+):
+    names = list(scenarios)
+    weights = [weight for _, weight in scenarios.values()]
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as http:
+        client = Client(http, username, chat_ids, random.Random(seed))
+        response = await signin(client)
+        response.raise_for_status()
+        while time.perf_counter() < deadline:
+            name = client.rng.choices(names, weights)[0]
+            scenario, _ = scenarios[name]
+            started = time.perf_counter()
+            try:
+                response = await scenario(client)
+            except httpx.HTTPError:
+                errors[name] += 1
+                continue
+            if response.is_error:
+                errors[name] += 1
+                continue
+            latencies[name].append((time.perf_counter() - started) * 1000)
+
+
+async def drive(base_url: str, dataset, args) -> dict:
+    scenarios = {
+        name: SCENARIOS[name] for name in args.routes or list(SCENARIOS)
+    }
+    latencies: dict[str, list[float]] = {name: [] for name in scenarios}
+    errors = {name: 0 for name in scenarios}
+    members = [name for name in dataset.usernames if dataset.chats[name]]
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(
+        *(
+            client_loop(
+                base_url,
+                members[n % len(members)],
+                dataset.chats[members[n % len(members)]],
+                scenarios,
+                deadline,
+                latencies,
+                errors,
+                args.seed + n,
+            )
+            for n in range(args.concurrency)
+        )
+    )
+    return {
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "rps": sum(map(len, latencies.values())) / args.duration,
+        "routes": {
+            name: {
+                "rps": len(values) / args.duration,
+                "errors": errors[name],
+                **summary(values),
+            }
+            for name, values in latencies.items()
+        },
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Relative change of rps and latency percentiles, in percent"""
+
+    def change(new: float, old: float) -> float | None:
+        return round((new - old) / old * 100, 1) if old else None
+
+    routes = {}
+    for name, route in report["routes"].items():
+        old = baseline["routes"].get(name)
+        if old is None:
+            continue
+        routes[name] = {
+            key: change(route[key], old[key])
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return {"rps": change(report["rps"], baseline["rps"]), "routes": routes}
+
+
+def run(args):
+    if args.sqlite:
+        os.environ["DB_CONNECTION_STRING"] = f"sqlite:///{args.sqlite}"
+    if args.fake_redis:
+        environment.use_fake_redis()
+    engine = environment.get_engine()
+    if not args.skip_seed:
+        environment.seed(engine, args)
+    dataset = environment.load_dataset(engine)
+
+    if args.base_url:
+        report = asyncio.run(drive(args.base_url, dataset, args))
+    else:
+        port = environment.free_port()
+        base_url = (
+            f"http://127.0.0.1:{port}{get_fastapi_settings().base_path}"
+        )
+        with environment.AppServer(port):
+            report = asyncio.run(drive(base_url, dataset, args))
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            report["change_percent"] = compare(report, json.load(file))
+    print(json.dumps(report, indent=2))
+    failed = [
+        name for name, route in report["routes"].items() if route["errors"]
+    ]
+    if failed:
+        # Broken run must not become a baseline
+        raise SystemExit(f"Requests failed on: {', '.join(failed)}")
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--base-url")
+    parser.add_argument("--sqlite")
+    parser.add_argument("--fake-redis", action="store_true")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--routes", nargs="+")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save")
+    parser.add_argument("--baseline")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
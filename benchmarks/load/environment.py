@@ -0,0 +1,165 @@
+"""
+Application boot and data seeding for the load benchmark.
+"""
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import uvicorn
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database.models import Base, Chat, Message, User, UserChat
+from app.dependencies.database import (get_async_connection_string,
+                                       get_async_sql_alchemy_engine,
+                                       get_sql_alchemy_engine)
+from app.dependencies.settings import get_auth_settings, get_database_settings
+
+PASSWORD = "load"
+USERNAME_PREFIX = "load-"
+INSERT_BATCH_SIZE = 10000
+
+
+@dataclass
+class Dataset:
+    usernames: list[str] = field(default_factory=list)
+    chats: dict[str, list[int]] = field(default_factory=dict)
+
+
+def use_fake_redis():
+    """Replaces the app redis client, must run before app.main is imported"""
+    from fakeredis import FakeServer
+    from fakeredis.aioredis import FakeRedis
+
+    from app.dependencies import clients
+
+    server = FakeServer()
+    clients.get_redis_client = lru_cache()(
+        lambda: FakeRedis(server=server, decode_responses=True)
+    )
+
+
+def is_sqlite() -> bool:
+    return get_database_settings().connection_string.startswith("sqlite")
+
+
+def get_engine() -> Engine:
+    if is_sqlite():
+        # App engines pass postgres only connect_args
+        return create_engine(get_database_settings().connection_string)
+    return get_sql_alchemy_engine()
+
+
+def seed(engine: Engine, args):
+    if is_sqlite():
+        Base.metadata.create_all(engine)
+    # Hashing thousands of passwords takes minutes, everyone shares one
+    passhash = get_auth_settings().pwd_context.hash(PASSWORD)
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        user_ids = connection.scalars(
+            insert(User).returning(User.id),
+            [
+                {"username": f"{USERNAME_PREFIX}{n}", "passhash": passhash}
+                for n in range(args.users)
+            ],
+        ).all()
+        chat_ids = connection.scalars(
+            insert(Chat).returning(Chat.id),
+            [{"name": f"{USERNAME_PREFIX}{n}"} for n in range(args.chats)],
+        ).all()
+        members = sorted(
+            (user_id, chat_id)
+            for chat_id in chat_ids
+            for user_id in rng.sample(
+                user_ids, min(args.members, len(user_ids))
+            )
+        )
+        connection.execute(
+            insert(UserChat),
+            [
+                {"user_id": user_id, "chat_id": chat_id}
+                for user_id, chat_id in members
+            ],
+        )
+        for offset in range(0, args.messages, INSERT_BATCH_SIZE):
+            size = min(INSERT_BATCH_SIZE, args.messages - offset)
+            connection.execute(
+                insert(Message),
+                [
+                    {
+                        "user_id": user_id,
+                        "chat_id": chat_id,
+                        "content": f"load message {offset + n}",
+                    }
+                    for n, (user_id, chat_id) in enumerate(
+                        rng.choices(members, k=size)
+                    )
+                ],
+            )
+    print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+
+def load_dataset(engine: Engine) -> Dataset:
+    dataset = Dataset()
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(User.username, UserChat.chat_id)
+            .outerjoin(UserChat, UserChat.user_id == User.id)
+            .where(User.username.startswith(USERNAME_PREFIX))
+            .order_by(User.id)
+        )
+        for username, chat_id in rows:
+            chats = dataset.chats.setdefault(username, [])
+            if chat_id is not None:
+                chats.append(chat_id)
+    dataset.usernames = list(dataset.chats)
+    if not dataset.usernames:
+        raise SystemExit("No benchmark users, run without --skip-seed")
+    return dataset
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """Serves app.main:app with uvicorn from a background thread"""
+
+    def __init__(self, port: int):
+        from app.main import app
+
+        if is_sqlite():
+            engine = create_async_engine(
+                get_async_connection_string(
+                    get_database_settings().connection_string
+                )
+            )
+            app.dependency_overrides[
+                get_async_sql_alchemy_engine
+            ] = lambda: engine
+        self.server = uvicorn.Server(
+            uvicorn.Config(
+                app, host="127.0.0.1", port=port, log_level="warning"
+            )
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "AppServer":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise SystemExit("Server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *_):
+        self.server.should_exit = True
+        self.thread.join()
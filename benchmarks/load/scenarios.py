@@ -0,0 +1,105 @@
+"""
+Requests issued by the load benchmark clients, one coroutine per route.
+"""
+import random
+from dataclasses import dataclass, field
+
+import httpx
+
+from benchmarks.load.environment import PASSWORD
+
+
+@dataclass
+class Client:
+    http: httpx.AsyncClient
+    username: str
+    chat_ids: list[int]
+    rng: random.Random
+    headers: dict[str, str] = field(default_factory=dict)
+    # Oldest loaded message id per chat
+    cursors: dict[int, int] = field(default_factory=dict)
+
+    def chat_id(self) -> int:
+        return self.rng.choice(self.chat_ids)
+
+
+async def signin(client: Client) -> httpx.Response:
+    response = await client.http.post(
+        "/auth/signin",
+        data={"username": client.username, "password": PASSWORD},
+    )
+    if response.status_code == 200:
+        client.headers = {
+            "Authorization": f"Bearer {response.json()['access_token']}"
+        }
+    return response
+
+
+async def me(client: Client) -> httpx.Response:
+    return await client.http.get("/user/me", headers=client.headers)
+
+
+async def my_chats(client: Client) -> httpx.Response:
+    return await client.http.get("/chat/my_chats", headers=client.headers)
+
+
+async def history(client: Client, chat_id: int) -> httpx.Response:
+    params = {"page_size": 50}
+    if chat_id in client.cursors:
+        params["start"] = client.cursors[chat_id]
+    response = await client.http.get(
+        f"/chat/{chat_id}/messages", params=params, headers=client.headers
+    )
+    if response.status_code != 200:
+        return response
+    if response.json():
+        client.cursors[chat_id] = response.json()[0]["id"]
+    else:
+        # Reached the first message, start over from the latest page
+        client.cursors.pop(chat_id, None)
+    return response
+
+
+async def history_latest(client: Client) -> httpx.Response:
+    chat_id = client.chat_id()
+    client.cursors.pop(chat_id, None)
+    return await history(client, chat_id)
+
+
+async def history_page(client: Client) -> httpx.Response:
+    """Next older page of a chat opened by history_latest"""
+    if not client.cursors:
+        return await history_latest(client)
+    return await history(client, client.rng.choice(list(client.cursors)))
+
+
+async def send_message(client: Client) -> httpx.Response:
+    return await client.http.post(
+        f"/chat/{client.chat_id()}/message",
+        json={"content": f"load {client.rng.random()}"},
+        headers=client.headers,
+    )
+
+
+async def search(client: Client) -> httpx.Response:
+    return await client.http.get(
+        "/user/",
+        params={
+            "match": f"load-{client.rng.randrange(100)}",
+            "mode": "prefix",
+            "limit": 10,
+        },
+        headers=client.headers,
+    )
+
+
+# Relative weights of the default mix, roughly a chat client session
+SCENARIOS = {
+    "signin": (signin, 1),
+    "me": (me, 10),
+    "my_chats": (my_chats, 10),
+    "history_latest": (history_latest, 20),
+    "history_page": (history_page, 10),
+    "send_message": (send_message, 10),
+    "search": (search, 5),
+}
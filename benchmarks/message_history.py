@@ -0,0 +1,148 @@
+"""
+Chat history query plans and latency on a large message table.
+
+Seeds ``--messages`` messages spread over ``--chats`` chats with
+generate_series (Postgres only, uses DB_CONNECTION_STRING), then prints
+EXPLAIN ANALYZE for every get_messages cursor and latency percentiles
+over ``--queries`` random pages. Run once before and once after
+``alembic upgrade head`` to compare plans.
+
+Usage:
+    python -m benchmarks.message_history --messages 10000000
+    python -m benchmarks.message_history --skip-seed
+"""
+import argparse
+import json
+import random
+import time
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Connection
+
+from app.database.models import Chat, Message
+from app.dependencies.database import get_sql_alchemy_engine
+from benchmarks.websocket_latency import summary
+
+SEED_SQL = """
+    INSERT INTO "user" (username, passhash)
+    SELECT 'history-bench-' || n, 'x' FROM generate_series(1, :users) n
+    ON CONFLICT DO NOTHING;
+    INSERT INTO chat (name)
+    SELECT 'history-bench-' || n FROM generate_series(1, :chats) n;
+    INSERT INTO message (user_id, chat_id, content, date_send)
+    SELECT
+        (
+            SELECT min(id) FROM "user" WHERE username LIKE 'history-bench-%'
+        ) + n % :users,
+        (SELECT max(id) FROM chat) - n % :chats,
+        md5(n::text),
+        now() - (:messages - n) * interval '1 second'
+    FROM generate_series(1, :messages) n;
+    ANALYZE "user";
+    ANALYZE chat;
+    ANALYZE message;
+"""
+
+
+def seed(connection: Connection, args):
+    started = time.perf_counter()
+    for statement in SEED_SQL.split(";"):
+        if statement.strip():
+            connection.execute(
+                text(statement),
+                {
+                    "users": args.users,
+                    "chats": args.chats,
+                    "messages": args.messages,
+                },
+            )
+    connection.commit()
+    print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+
+def page_queries(chat_id: int, cursor: int, page_size: int) -> dict:
+    chat_messages = select(Message).where(Message.chat_id == chat_id)
+    newest = chat_messages.order_by(Message.id.desc())
+    return {
+        "latest": newest.limit(page_size),
+        "start": newest.where(Message.id < cursor).limit(page_size),
+        "after": chat_messages.where(Message.id > cursor)
+        .order_by(Message.id)
+        .limit(page_size),
+        "around": newest.where(Message.id <= cursor).limit(page_size // 2),
+    }
+
+
+def compile_query(connection: Connection, query) -> str:
+    return str(
+        query.compile(connection, compile_kwargs={"literal_binds": True})
+    )
+
+
+def run(args):
+    engine = get_sql_alchemy_engine()
+    with engine.connect() as connection:
+        if not args.skip_seed:
+            seed(connection, args)
+        chat_ids = connection.scalars(
+            select(Chat.id).where(Chat.name.like("history-bench-%"))
+        ).all()
+        chat_id = random.choice(chat_ids)
+        cursor = connection.scalar(
+            select(func.percentile_disc(0.5).within_group(Message.id)).where(
+                Message.chat_id == chat_id
+            )
+        )
+        for name, query in page_queries(chat_id, cursor, args.page).items():
+            plan = connection.execute(
+                text(
+                    "EXPLAIN (ANALYZE, BUFFERS) "
+                    + compile_query(connection, query)
+                )
+            )
+            print(f"-- {name}")
+            print("\n".join(row[0] for row in plan))
+
+        bounds = {
+            chat_id: (low, high)
+            for chat_id, low, high in connection.execute(
+                select(
+                    Message.chat_id, func.min(Message.id), func.max(Message.id)
+                )
+                .where(Message.chat_id.in_(chat_ids))
+                .group_by(Message.chat_id)
+            )
+        }
+        latencies: dict[str, list[float]] = {}
+        for _ in range(args.queries):
+            chat_id = random.choice(chat_ids)
+            cursor = random.randint(*bounds[chat_id])
+            queries = page_queries(chat_id, cursor, args.page)
+            for name, query in queries.items():
+                started = time.perf_counter()
+                connection.execute(query).all()
+                latencies.setdefault(name, []).append(
+                    (time.perf_counter() - started) * 1000
+                )
+        connection.rollback()
+    print(
+        json.dumps(
+            {name: summary(values) for name, values in latencies.items()},
+            indent=2,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--skip-seed", action="store_true")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Signin password verification throughput, inline vs process pool.
+
+Runs ``--concurrency`` concurrent verifications for ``--duration`` seconds
+through PasswordHasher, first with workers = 0 (anyio threadpool, the
+old inline behaviour) and then with ``--workers`` processes. Also reports
+event loop lag measured by a 10ms ticker running next to the load.
+
+Usage:
+    python -m benchmarks.signin_throughput --rounds 12 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from passlib.context import CryptContext
+
+from app.dependencies.hashing import PasswordHasher
+from app.services.exceptions import OverloadedError
+from benchmarks.websocket_latency import summary
+
+
+async def ticker(deadline: float, lags: list[float]):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+
+async def signin(
+    hasher: PasswordHasher,
+    passhash: str,
+    deadline: float,
+    latencies: list[float],
+    rejected: list[int],
+):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            verified, _ = await hasher.verify_and_update("password", passhash)
+            assert verified
+        except OverloadedError:
+            rejected.append(1)
+            await asyncio.sleep(0.01)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def measure(hasher: PasswordHasher, passhash: str, args) -> dict:
+    latencies: list[float] = []
+    lags: list[float] = []
+    rejected: list[int] = []
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(
+        ticker(deadline, lags),
+        *(
+            signin(hasher, passhash, deadline, latencies, rejected)
+            for _ in range(args.concurrency)
+        ),
+    )
+    return {
+        "signins_per_second": len(latencies) / args.duration,
+        "rejected": len(rejected),
+        "signin": summary(latencies),
+        "event_loop_lag": summary(lags),
+    }
+
+
+async def run(args):
+    context = CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=args.rounds
+    )
+    passhash = context.hash("password")
+    results = {}
+    for name, workers in (("inline", 0), ("pool", args.workers)):
+        hasher = PasswordHasher(context, workers, args.queue_size)
+        if workers:
+            # Spawn workers before measuring
+            await asyncio.gather(
+                *(hasher.hash("warmup") for _ in range(workers))
+            )
+        results[name] = await measure(hasher, passhash, args)
+        hasher.close()
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Tokens signed and verified per second for each supported algorithm.
+
+Keys are generated in memory. Every algorithm is measured twice: with
+PEM text passed to python-jose on each call (old behaviour) and with key
+objects parsed once, as app.dependencies.auth does now.
+
+Usage:
+    python -m benchmarks.token_algorithms --duration 2
+"""
+import argparse
+import json
+import time
+from typing import Callable
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import jwk, jwt
+
+CLAIMS = {
+    "sub": "1",
+    "name": "benchmark",
+    "jti": "00000000-0000-0000-0000-000000000000",
+    "iat": 1700000000,
+    "exp": 4100000000,
+}
+
+
+def generate_keys(algorithm: str) -> tuple[str, str]:
+    if algorithm.startswith("RS"):
+        private = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+    else:
+        curve = {"ES256": ec.SECP256R1, "ES384": ec.SECP384R1}[algorithm]
+        private = ec.generate_private_key(curve())
+    private_pem = private.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = private.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return private_pem.decode("ascii"), public_pem.decode("ascii")
+
+
+def rate(func: Callable, duration: float) -> float:
+    count = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        func()
+        count += 1
+    return count / duration
+
+
+def measure(algorithm: str, duration: float) -> dict[str, float]:
+    private_pem, public_pem = generate_keys(algorithm)
+    private_key = jwk.construct(private_pem, algorithm)
+    public_key = jwk.construct(public_pem, algorithm)
+    token = jwt.encode(CLAIMS, private_key, algorithm=algorithm)
+    return {
+        "sign_pem_per_s": rate(
+            lambda: jwt.encode(
+                CLAIMS, private_pem.encode("ascii"), algorithm=algorithm
+            ),
+            duration,
+        ),
+        "sign_parsed_per_s": rate(
+            lambda: jwt.encode(CLAIMS, private_key, algorithm=algorithm),
+            duration,
+        ),
+        "verify_pem_per_s": rate(
+            lambda: jwt.decode(token, public_pem, algorithms=[algorithm]),
+            duration,
+        ),
+        "verify_parsed_per_s": rate(
+            lambda: jwt.decode(token, public_key, algorithms=[algorithm]),
+            duration,
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--algorithms", nargs="+", default=["RS256", "ES256", "ES384"]
+    )
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+    results = {
+        algorithm: measure(algorithm, args.duration)
+        for algorithm in args.algorithms
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Websocket delivery latency while HTTP writes are running.
+
+Signs up a writer and a reader, opens ``--sockets`` reader websockets to
+one chat and posts messages from ``--writers`` concurrent HTTP clients.
+Every message carries its send timestamp, so each socket can measure how
+long the broadcast took to reach it.
+
+Usage:
+    python -m benchmarks.websocket_latency --base-url http://localhost:8002
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from uuid import uuid4
+
+import httpx
+import websockets
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def summary(values: list[float]) -> dict[str, float]:
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) if values else 0.0,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": max(values, default=0.0),
+    }
+
+
+async def signup(client: httpx.AsyncClient) -> dict[str, str]:
+    response = await client.post(
+        "/auth/signup",
+        json={"username": f"bench-{uuid4().hex[:16]}", "password": "bench"},
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def prepare_chat(client: httpx.AsyncClient):
+    writer = await signup(client)
+    reader = await signup(client)
+    reader_id = (await client.get("/user/me", headers=reader)).json()["id"]
+    response = await client.post(
+        "/chat/", json={"name": "latency benchmark"}, headers=writer
+    )
+    response.raise_for_status()
+    chat_id = response.json()["id"]
+    response = await client.post(
+        f"/chat/{chat_id}/user", json={"user_id": reader_id}, headers=writer
+    )
+    response.raise_for_status()
+    return chat_id, writer, reader
+
+
+async def listen(url: str, latencies: list[float], ready: asyncio.Event):
+    async with websockets.connect(url) as websocket:
+        ready.set()
+        async for data in websocket:
+            message = json.loads(data)
+            sent = int(message["content"])
+            latencies.append((time.perf_counter_ns() - sent) / 1e6)
+
+
+async def write(
+    client: httpx.AsyncClient,
+    chat_id: int,
+    headers: dict[str, str],
+    deadline: float,
+    latencies: list[float],
+):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter_ns()
+        response = await client.post(
+            f"/chat/{chat_id}/message",
+            json={"content": str(started)},
+            headers=headers,
+        )
+        response.raise_for_status()
+        latencies.append((time.perf_counter_ns() - started) / 1e6)
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.writers + 1)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=30
+    ) as client:
+        chat_id, writer, reader = await prepare_chat(client)
+        token = reader["Authorization"].split()[1]
+        ws_url = (
+            args.base_url.replace("http", "ws", 1)
+            + f"/ws/chat/{chat_id}/messages?token={token}"
+        )
+
+        delivery: list[float] = []
+        readies = [asyncio.Event() for _ in range(args.sockets)]
+        listeners = [
+            asyncio.create_task(listen(ws_url, delivery, ready))
+            for ready in readies
+        ]
+        await asyncio.gather(*(ready.wait() for ready in readies))
+
+        writes: list[float] = []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *(
+                write(client, chat_id, writer, deadline, writes)
+                for _ in range(args.writers)
+            )
+        )
+        await asyncio.sleep(1)
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+    print(
+        json.dumps(
+            {
+                "sockets": args.sockets,
+                "writers": args.writers,
+                "duration_s": args.duration,
+                "http_post": summary(writes),
+                "websocket_delivery": summary(delivery),
+            },
+            indent=2,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--base-url", default="http://localhost:8002")
+    parser.add_argument("--sockets", type=int, default=50)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
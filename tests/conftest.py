@@ -0,0 +1,100 @@
+"""
+Runs the app on a temporary SQLite database and in-process fakeredis.
+Settings are read from environment on first use, so they are set here
+before any test imports app modules.
+"""
+import os
+import tempfile
+from functools import lru_cache
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+TEMP_DIR = tempfile.mkdtemp(prefix="practice-works-tests-")
+
+
+def write_keys() -> tuple[str, str]:
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    paths = (
+        os.path.join(TEMP_DIR, "jwt-key"),
+        os.path.join(TEMP_DIR, "jwt-key.pub"),
+    )
+    keys = (
+        private.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ),
+        private.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ),
+    )
+    for path, key in zip(paths, keys):
+        with open(path, "wb") as file:
+            file.write(key)
+    return paths
+
+
+private_key, public_key = write_keys()
+os.environ.update(
+    DB_CONNECTION_STRING=f"sqlite:///{TEMP_DIR}/db.sqlite",
+    DB_APPLICATION_NAME="tests",
+    SERVICE_BASE_PATH="/api",
+    SERVICE_METRICS_ENABLED="false",
+    JWT_PRIVATE_KEY=private_key,
+    JWT_PUBLIC_KEY=public_key,
+    JWT_ACCESS_TOKEN_EXPIRE_MINUTES="30",
+    JWT_REFRESH_TOKEN_EXPIRE_DAYS="7",
+    JWT_BCRYPT_ROUNDS="4",
+)
+# Real redis is only used by tests that ask for it explicitly
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app.dependencies import clients
+
+    server = FakeServer()
+    clients.get_redis_client = lru_cache()(
+        lambda: FakeRedis(server=server, decode_responses=True)
+    )
+
+    from app.database.models import Base
+    from app.dependencies.database import get_async_sql_alchemy_engine
+    from app.dependencies.query_stats import instrument_engine
+    from app.main import app
+
+    Base.metadata.create_all(sync_engine())
+    # App engines pass postgres only connect_args
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{TEMP_DIR}/db.sqlite"
+    )
+    instrument_engine(engine.sync_engine)
+    app.dependency_overrides[get_async_sql_alchemy_engine] = lambda: engine
+    return app
+
+
+@lru_cache()
+def sync_engine() -> Engine:
+    return create_engine(f"sqlite:///{TEMP_DIR}/db.sqlite")
+
+
+@pytest.fixture(scope="session")
+def engine(app) -> Engine:
+    return sync_engine()
+
+
+@pytest.fixture(scope="session")
+def client(app) -> TestClient:
+    with TestClient(app) as client:
+        yield client
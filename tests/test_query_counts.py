@@ -0,0 +1,83 @@
+"""
+Chat listings cost the same number of queries whatever their size
+"""
+import pytest
+from sqlalchemy import insert
+
+from app.database.models import Chat, User, UserChat
+from app.dependencies.query_stats import assert_max_queries
+
+
+def signup(client, username: str) -> tuple[int, dict[str, str]]:
+    response = client.post(
+        "/api/auth/signup", json={"username": username, "password": "pw"}
+    )
+    assert response.status_code == 201, response.text
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return client.get("/api/user/me", headers=headers).json()["id"], headers
+
+
+def seed(engine, user_id: int, size: int) -> int:
+    """
+    Puts user into size chats and size - 1 other users into one of them,
+    returns id of that chat
+    """
+    with engine.begin() as connection:
+        chat_ids = connection.scalars(
+            insert(Chat).returning(Chat.id),
+            [{"name": f"chat {n}"} for n in range(size)],
+        ).all()
+        member_ids = connection.scalars(
+            insert(User).returning(User.id),
+            [
+                {"username": f"member-{user_id}-{n}", "passhash": "x"}
+                for n in range(size - 1)
+            ],
+        ).all()
+        connection.execute(
+            insert(UserChat),
+            [{"user_id": user_id, "chat_id": chat_id} for chat_id in chat_ids]
+            + [
+                {"user_id": member_id, "chat_id": chat_ids[0]}
+                for member_id in member_ids
+            ],
+        )
+    return chat_ids[0]
+
+
+def count_queries(
+    client, headers: dict[str, str], url: str, max_count: int
+) -> int:
+    # Warm user and membership caches, they are not part of the listing
+    assert client.get(url, headers=headers).status_code == 200
+    with assert_max_queries(max_count) as stats:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.text
+    return stats.count
+
+
+@pytest.mark.parametrize(
+    "url, queries",
+    [
+        # Listing itself
+        ("/api/chat/my_chats", 1),
+        # Chat lookup and listing, membership is answered by redis
+        ("/api/chat/{chat_id}/users", 2),
+    ],
+)
+def test_listing_query_count_does_not_grow(client, engine, url, queries):
+    counts = {}
+    for size in (2, 100):
+        user_id, headers = signup(client, f"listing-{size}-{len(url)}")
+        chat_id = seed(engine, user_id, size)
+        listing = url.format(chat_id=chat_id)
+        assert len(client.get(listing, headers=headers).json()) == size
+        counts[size] = count_queries(client, headers, listing, queries)
+    assert counts[2] == counts[100] == queries
+
+
+def test_assert_max_queries_fails_over_limit(client):
+    _, headers = signup(client, "over-limit")
+    with pytest.raises(AssertionError, match="Expected at most 0 queries"):
+        with assert_max_queries(0):
+            client.get("/api/chat/my_chats", headers=headers)
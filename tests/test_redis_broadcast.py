@@ -0,0 +1,139 @@
+"""
+Messages published in one process reach sockets of another one through
+redis pub/sub. Needs a redis at REDIS_HOST, skipped when unreachable
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from datetime import datetime
+
+import pytest
+import redis
+
+CHAT_ID = 424242
+CHANNEL = f"broadcast:chat:{CHAT_ID}"
+TIMEOUT = 10
+
+
+def redis_client() -> redis.Redis:
+    return redis.Redis(
+        host=os.environ["REDIS_HOST"],
+        port=int(os.environ.get("REDIS_PORT", 6379)),
+        password=os.environ["REDIS_PASSWORD"] or None,
+        socket_connect_timeout=1,
+        decode_responses=True,
+    )
+
+
+@pytest.fixture()
+def client() -> redis.Redis:
+    client = redis_client()
+    try:
+        client.ping()
+    except redis.RedisError as exc:
+        pytest.skip(f"redis is unreachable: {exc}")
+    yield client
+    client.close()
+
+
+def subscribers(client: redis.Redis) -> int:
+    return dict(client.pubsub_numsub(CHANNEL))[CHANNEL]
+
+
+def wait_for_subscribers(client: redis.Redis, count: int):
+    for _ in range(TIMEOUT * 10):
+        if subscribers(client) == count:
+            return
+        time.sleep(0.1)
+    assert subscribers(client) == count
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.frames = asyncio.Queue()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        await self.frames.put(data)
+
+    async def close(self, *args, **kwargs):
+        pass
+
+
+async def listen(ready, received, disconnected, checked):
+    from app.dependencies.clients import (ChatSocketsManager,
+                                          RedisBroadcastBackend)
+
+    manager = ChatSocketsManager(RedisBroadcastBackend())
+    websocket = RecordingWebSocket()
+    await manager.connect(websocket, 1, [CHAT_ID])
+    ready.set()
+    received.put(await asyncio.wait_for(websocket.frames.get(), TIMEOUT))
+    await manager.disconnect(websocket)
+    disconnected.set()
+    # Keep the pub/sub connection open while unsubscription is checked
+    await asyncio.get_running_loop().run_in_executor(
+        None, checked.wait, TIMEOUT * 3
+    )
+    await manager.backend.close()
+
+
+async def publish():
+    from app.dependencies.clients import (ChatSocketsManager,
+                                          RedisBroadcastBackend)
+    from app.schemas.message_schemas import MessageGetSchema
+
+    manager = ChatSocketsManager(RedisBroadcastBackend())
+    await manager.send_message(
+        CHAT_ID,
+        MessageGetSchema(
+            id=1,
+            chat_id=CHAT_ID,
+            user_id=2,
+            content="across processes",
+            date_send=datetime(2023, 1, 1),
+        ),
+    )
+    await manager.backend.close()
+
+
+def run_listener(*events):
+    asyncio.run(listen(*events))
+
+
+def run_publisher():
+    asyncio.run(publish())
+
+
+def test_message_reaches_other_process(client):
+    context = multiprocessing.get_context("spawn")
+    ready, disconnected, checked = (context.Event() for _ in range(3))
+    received = context.Queue()
+    listener = context.Process(
+        target=run_listener, args=(ready, received, disconnected, checked)
+    )
+    listener.start()
+    try:
+        assert ready.wait(TIMEOUT), "listener didn't connect"
+        wait_for_subscribers(client, 1)
+
+        publisher = context.Process(target=run_publisher)
+        publisher.start()
+        publisher.join(TIMEOUT)
+        assert publisher.exitcode == 0
+
+        frame = received.get(timeout=TIMEOUT)
+        assert '"content":"across processes"' in frame
+
+        assert disconnected.wait(TIMEOUT), "listener didn't disconnect"
+        wait_for_subscribers(client, 0)
+        assert listener.is_alive()
+    finally:
+        checked.set()
+        listener.join(TIMEOUT)
+        if listener.is_alive():
+            listener.kill()
+    assert listener.exitcode == 0
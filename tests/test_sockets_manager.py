@@ -0,0 +1,106 @@
+"""
+Topic subscriptions of sockets manager stay consistent with broadcast
+backend when subscribing is slow or fails
+"""
+import asyncio
+
+import pytest
+
+from app.dependencies.clients import ChatSocketsManager, MemoryBroadcastBackend
+
+USER_ID = 1
+CHAT_ID = 2
+
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000, reason: str | None = None):
+        pass
+
+
+class SlowBackend(MemoryBroadcastBackend):
+    """
+    Yields to event loop inside subscribe and fails first failures calls,
+    so other connections arrive while subscription is in flight
+    """
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    async def subscribe(self, topic: str, callback):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Broadcast backend is down")
+        await super().subscribe(topic, callback)
+
+
+async def connect_many(manager: ChatSocketsManager, count: int, **kwargs):
+    return await asyncio.gather(
+        *(
+            manager.connect(FakeWebSocket(), USER_ID, **kwargs)
+            for _ in range(count)
+        ),
+        return_exceptions=True,
+    )
+
+
+async def close_all(manager: ChatSocketsManager):
+    for websocket in list(manager.connections):
+        await manager.disconnect(websocket)
+
+
+def test_failed_subscribe_leaves_no_index_entry():
+    async def run():
+        backend = SlowBackend(failures=1)
+        manager = ChatSocketsManager(backend)
+        results = await connect_many(manager, 2)
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert backend.calls == 1
+        assert USER_ID not in manager.users
+        assert not manager.pending
+        # Next connection retries instead of assuming topic is subscribed
+        connection = await manager.connect(FakeWebSocket(), USER_ID)
+        assert backend.calls == 2
+        assert manager.users[USER_ID] == {connection}
+        assert f"user:{USER_ID}" in backend.callbacks
+        await close_all(manager)
+        assert not manager.users
+        assert not backend.callbacks
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("failures", [0, 1])
+def test_concurrent_chat_subscribers_share_subscription(failures: int):
+    async def run():
+        backend = SlowBackend()
+        manager = ChatSocketsManager(backend)
+        first, second = await connect_many(manager, 2)
+        backend.failures = failures
+        results = await asyncio.gather(
+            manager.subscribe(first, CHAT_ID),
+            manager.subscribe(second, CHAT_ID),
+            return_exceptions=True,
+        )
+        assert backend.calls == 2
+        if failures:
+            assert all(isinstance(item, ConnectionError) for item in results)
+            assert CHAT_ID not in manager.chats
+            assert f"chat:{CHAT_ID}" not in backend.callbacks
+        else:
+            assert manager.chats[CHAT_ID] == {first, second}
+            assert f"chat:{CHAT_ID}" in backend.callbacks
+        await close_all(manager)
+        assert not manager.chats
+        assert not backend.callbacks
+
+    asyncio.run(run())